@@ -432,7 +432,10 @@ cdef extern from "fraktal_sft.h":
         bool m_bStop # actually a std::atomic<bool> but that's irrelevant
 
         uint32_t *m_nPixels_LSB
-        uint32_t *m_nPixels_MSB # TODO
+        uint32_t *m_nPixels_MSB
+        float *m_nTrans
+        float *m_nDEx
+        float *m_nDEy
         int m_row # stride
 
         uint8_t *m_lpBits
@@ -452,17 +455,17 @@ cdef extern from "fraktal_sft.h":
         void SetIterations(int64_t nIterations)
         void FixIterLimit() nogil
         string GetRe()
-        string GetRe(int nXPos, int nYPos, int width, int height)
+        string GetRe(int nXPos, int nYPos, int width, int height) nogil
         string GetIm()
-        string GetIm(int nXPos, int nYPos, int width, int height)
+        string GetIm(int nXPos, int nYPos, int width, int height) nogil
         string GetZoom()
         void GenerateColors(int nParts, int nSeed = -1)
         void GenerateColors2(int nParts, int nSeed = -1, int nWaves = 9)
         void AddWave(int nCol, int nPeriod = -1, int nStart = -1)
         void ChangeNumOfColors(int nParts)
         int GetNumOfColors()
-        void ApplyColors(int x0, int x1, int y0, int y1)
-        void ApplyColors()
+        void ApplyColors(int x0, int x1, int y0, int y1) nogil
+        void ApplyColors() nogil
         void SetColor(int x, int y, int w, int h)
 
         void ApplyIterationColors()
@@ -475,12 +478,12 @@ cdef extern from "fraktal_sft.h":
         COLOR14 GetInteriorColor()
         void SetInteriorColor(COLOR14 &c)
         void ResetParameters()
-        bool OpenFile(string &szFile, bool bNoLocation)
-        bool OpenString(string &szText, bool bNoLocation)
-        bool OpenMapB(string &szFile, bool bReuseCenter, double nZoomSize)
-        bool OpenMapEXR(string &szFile)
-        string ToText()
-        bool SaveFile(string &szFile, bool overwrite)
+        bool OpenFile(string &szFile, bool bNoLocation) nogil
+        bool OpenString(string &szText, bool bNoLocation) nogil
+        bool OpenMapB(string &szFile, bool bReuseCenter, double nZoomSize) nogil
+        bool OpenMapEXR(string &szFile) nogil
+        string ToText() nogil
+        bool SaveFile(string &szFile, bool overwrite) nogil
         double GetIterDiv()
         void SetIterDiv(double nIterDiv)
         int SaveEXR (const string &filename
@@ -489,11 +492,11 @@ cdef extern from "fraktal_sft.h":
                 , int nHeight
                 , const string &comment
                 , unsigned int nParallel
-                )
+                ) nogil
 
         int64_t GetMaxApproximation()
-        int64_t GetIterationOnPoint(int x, int y)
-        double GetTransOnPoint(int x, int y)
+        int64_t GetIterationOnPoint(int x, int y) nogil
+        double GetTransOnPoint(int x, int y) nogil
         int m_bAutoGlitch
         void ResetGlitches()
         int m_bAddReference
@@ -516,7 +519,7 @@ cdef extern from "fraktal_sft.h":
         void SetITransition(bool bITransition)
 
         void SaveMap(string &szFile)
-        void SaveMapB(string &szFile)
+        void SaveMapB(string &szFile) nogil
 
         SmoothMethod GetSmoothMethod()
         void SetSmoothMethod(int nSmoothMethod)
@@ -579,10 +582,10 @@ cdef extern from "fraktal_sft.h":
         Guess GuessPixel(int x, int y, int x0, int y0, int x1, int y1)
         Guess GuessPixel(int x, int y, int w, int h)
 
-        bool OpenSettings(string &filename)
-        bool SaveSettings(string &filename, bool overwrite)
-        string GetSettings()
-        bool SetSettings(string data)
+        bool OpenSettings(string &filename) nogil
+        bool SaveSettings(string &filename, bool overwrite) nogil
+        string GetSettings() nogil
+        bool SetSettings(string data) nogil
 
         void SetTransformPolar(polar2 &P)
         polar2 GetTransformPolar()
@@ -1,3 +1,3 @@
 from .impl import Fractal
 
-from .core import __version__
+from .core import __version__, StaleBufferError
@@ -17,7 +17,7 @@ from trio_gtk import run
 
 @click.command(name="kf2", context_settings={"help_option_names":['-h','-H','-?','--help']})
 @click.option("-o","--load-map",type=click.Path(exists=True, dir_okay=False), help="load map file (EXR or KFB)")
-@click.option("-c","--load-palette",type=click.Path(exists=True, dir_okay=False), help="load palette file")
+@click.option("-c","--load-palette",type=click.Path(exists=True, dir_okay=False), multiple=True, help="load palette file; if repeated, save one colouring of a single render per palette (use {palette} in file names)")
 @click.option("-l","--load-location",type=click.Path(exists=True, dir_okay=False), help="load location file (KFR)")
 @click.option("-s","--load-settings",type=click.Path(exists=True, dir_okay=False), help="load settings file (KFS)")
 @click.option("-x","--save-exr",type=click.Path(dir_okay=False, readable=False,writable=True), help="save EXR")
@@ -28,39 +28,77 @@ from trio_gtk import run
 @click.option("-m","--save-map",type=click.Path(dir_okay=False, readable=False,writable=True), help="save KFB")
 @click.option("--save-kfr",type=click.Path(dir_okay=False, readable=False,writable=True), help="save KFR")
 @click.option("-z","--zoom-out",type=int,help="zoom sequence")
+@click.option("-P","--pipeline",type=int,default=0,help="zoom sequence: encode up to N frames while rendering the next")
+@click.option("-W","--workers",type=int,default=0,help="zoom sequence: render with N worker processes; service: keep N instances")
+@click.option("-T","--tile",type=int,help="render the TIFF in tiles of this size, to save memory")
 @click.option("-L","--log",type=str,help="logging verbosity")
+@click.option("--serve",type=click.Path(dir_okay=False, readable=False,writable=True), help="run a render service on this unix socket")
+@click.option("--stats",type=click.Path(dir_okay=False, readable=False,writable=True), help="append render statistics to this file (JSON lines)")
+@click.option("--trace",type=click.Path(dir_okay=False, readable=False,writable=True), help="write a Chrome trace of this run to this file")
 @click.option("-v","-V","--version",is_flag=True,help="show version")
-async def _main(load_map,load_palette,load_location,load_settings,save_exr,save_tif,save_png,save_jpg,jpg_quality,save_map,save_kfr,zoom_out,log,version):
+async def _main(load_map,load_palette,load_location,load_settings,save_exr,save_tif,save_png,save_jpg,jpg_quality,save_map,save_kfr,zoom_out,pipeline,workers,tile,log,serve,stats,trace,version):
 	if version:
 		print(kf2.__version__)
 		sys.exit(0)
 
+	if trace:
+		from kf2.trace import tracer
+		tracer.enable()
+	try:
+		await _run(load_map,load_palette,load_location,load_settings,save_exr,save_tif,save_png,save_jpg,jpg_quality,save_map,save_kfr,zoom_out,pipeline,workers,tile,log,serve,stats)
+	finally:
+		if trace:
+			tracer.save(trace)
+
+async def _run(load_map,load_palette,load_location,load_settings,save_exr,save_tif,save_png,save_jpg,jpg_quality,save_map,save_kfr,zoom_out,pipeline,workers,tile,log,serve,stats):
+	if serve:
+		from kf2.service import serve as serve_
+		await serve_(serve, instances=workers or 1)
+		return
+
 	kf = kf2.Fractal()
 	if log:
 		kf.log_level = log
+	if stats:
+		kf.stats_file = stats
 
 	batch = save_exr or save_tif or save_png or save_jpg or save_map or save_kfr
 	if load_settings:
-		kf.openSettings(load_settings)
+		await kf.async_openSettings(load_settings)
 	if load_location:
-		kf.openFile(load_location)
+		await kf.async_openFile(load_location)
 	if load_map:
 		try:
-			kf.openMapB(load_map)
+			await kf.async_openMapB(load_map)
 		except RuntimeError:
 			try:
-				kf.openMapEXR(load_map)
+				await kf.async_openMapEXR(load_map)
 			except RuntimeError:
 				print(f"{load_map !r}: File format not recognized", file=sys.stderr)
 				sys.exit(1)
 	if load_palette:
 		kf.inhibit_colouring = True
-		kf.openFile(load_palette)
+		await kf.async_openFile(load_palette[0])
 
 	async with trio.open_nursery() as n:
 		kf.n = n
-		if batch:
-			only_kfr = bool(save_kfr) and not bool(save_exr or save_pg or save_map or save_png or save_tif)
+		if batch and len(load_palette) > 1 and (zoom_out or tile):
+			print("Multiple palettes are only supported for single images", file=sys.stderr)
+			sys.exit(1)
+		if batch and tile:
+			if not save_tif or zoom_out or save_exr or save_png or save_jpg or save_map:
+				print("Tiled rendering only supports a single TIFF file (plus KFR)", file=sys.stderr)
+				sys.exit(1)
+			from kf2.tiled import render_tiled
+			x,y,s = kf.target_dimensions
+			if s > 1:
+				print("Tiled rendering doesn't support supersampling", file=sys.stderr)
+				sys.exit(1)
+			await render_tiled(kf, save_tif, x*s, y*s, tile=tile)
+			if save_kfr:
+				await kf.async_saveKFR(save_kfr)
+		elif batch:
+			only_kfr = bool(save_kfr) and not bool(save_exr or save_jpg or save_map or save_png or save_tif)
 			async with kf.render_lock():
 				x,y,s = kf.target_dimensions
 				kf.setImageSize(x*s,y*s)
@@ -68,11 +106,17 @@ async def _main(load_map,load_palette,load_location,load_settings,save_exr,save_
 			save_args = dict(save_exr=save_exr, save_tif=save_tif, save_jpg=save_jpg,
 					save_png=save_png, save_map=save_map, save_kfr=save_kfr,
 					quality=jpg_quality)
-			if zoom_out:
-				for frame in range(zoom_out):
-					await kf.render_frame(frame, only_kfr, **save_args)
-					if kf.zoom < .001:
-						break
+			if zoom_out and workers:
+				from kf2.workers import render_parallel
+				failed = await trio.to_thread.run_sync(partial(render_parallel, kf, zoom_out, only_kfr, workers, **save_args))
+				if failed:
+					print(f"Failed frames: {' '.join(str(f) for f in sorted(failed))}", file=sys.stderr)
+					sys.exit(1)
+			elif zoom_out:
+				await kf.render_sequence(zoom_out, only_kfr, pipeline=pipeline, **save_args)
+			elif len(load_palette) > 1 and not only_kfr:
+				await kf._render_frame(0, only_kfr)
+				await kf.save_palettes(0, load_palette, **save_args)
 			else:
 				await kf.render_frame(0, only_kfr, **save_args)
 		else:
@@ -0,0 +1,156 @@
+##
+# Render benchmarks.
+#
+# Renders a fixed set of bundled locations at fixed sizes, each in a fresh
+# process, and records where the time went: the library's phase timers,
+# the number of references, colouring, EXR/PNG saving and the process's
+# peak RSS. Results are JSON, so that a later run (new library, new kf2-py)
+# can be compared against a stored baseline.
+#
+# The library's default settings are used unless a settings file is given.
+##
+
+import io
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+HERE = os.path.join(os.path.dirname(__file__), "locations")
+
+LOCATIONS = {
+    # name: (KFR file, width, height)
+    "shallow": ("shallow.kfr", 1280, 720),
+    # the whole set
+    "deep": ("deep.kfr", 640, 360),
+    # c=i, a Misiurewicz point, at 1e50
+    "glitch": ("glitch.kfr", 640, 360),
+    # beside a period-1080 minibrot near the needle, at 7.8e8: the center
+    # reference escapes early, so glitch correction needs several more
+    "iterations": ("iterations.kfr", 640, 360),
+    # seahorse valley at 1e15, with a high iteration limit
+}
+
+TIMINGS = ("wall", "colouring", "save_exr", "pil_image", "png")
+# seconds; compared relative to the baseline
+
+MIN_DELTA = 0.05
+# don't report timing differences smaller than this many seconds
+
+
+def _bench_one(name:str, scale:float, settings:str, log_level:str):
+    """Render one location. Runs in a separate process."""
+    import trio
+    from .. import Fractal
+
+    kfr,w,h = LOCATIONS[name]
+    w,h = int(w*scale), int(h*scale)
+    kf = Fractal()
+    if log_level:
+        kf.log_level = log_level
+    if settings:
+        kf.openSettings(settings)
+    kf.openFile(os.path.join(HERE, kfr))
+
+    async def render():
+        async with trio.open_nursery() as n:
+            kf.n = n
+            async with kf.render_lock(name=f"bench {name} size"):
+                kf.setImageSize(w,h)
+            await kf.render(name=f"bench {name}", color=False)
+            n.cancel_scope.cancel()
+    trio.run(render)
+    stats = kf.render_stats
+
+    res = dict(width=w, height=h, wall=stats.wall,
+            references=stats.references, iterations=kf.iterations,
+            phases=stats.phases)
+
+    t = time.perf_counter()
+    kf.applyColors()
+    res["colouring"] = time.perf_counter()-t
+
+    with tempfile.TemporaryDirectory() as d:
+        t = time.perf_counter()
+        kf.saveEXR(os.path.join(d, "bench.exr"))
+        res["save_exr"] = time.perf_counter()-t
+
+    t = time.perf_counter()
+    img = kf.pilImage
+    res["pil_image"] = time.perf_counter()-t
+
+    t = time.perf_counter()
+    img.save(io.BytesIO(), format="png")
+    res["png"] = time.perf_counter()-t
+
+    res["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return res
+
+
+def run(names=None, scale:float = 1, repeat:int = 1, settings:str = None, log_level:str = None) -> dict:
+    """
+    Run the benchmarks. Returns a JSON-able dict.
+
+    With `repeat` > 1 every location is rendered that many times; the
+    fastest run is kept.
+    """
+    from .. import __version__
+
+    if names is None:
+        names = list(LOCATIONS)
+    results = {}
+    ctx = get_context("spawn")
+    for name in names:
+        if name not in LOCATIONS:
+            raise KeyError(f"unknown location {name !r}")
+        best = None
+        for _ in range(repeat):
+            # a fresh process per run, for honest memory numbers
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as ex:
+                res = ex.submit(_bench_one, name, scale, settings, log_level).result()
+            if best is None or res["wall"] < best["wall"]:
+                best = res
+        results[name] = best
+
+    return dict(version=__version__, python=sys.version.split()[0],
+            machine=platform.machine(), processor=platform.processor(),
+            cpus=os.cpu_count(), started=time.time(), scale=scale,
+            results=results)
+
+
+def compare(current:dict, baseline:dict, threshold:float = 0.1, rss_threshold:float = 0.1) -> list:
+    """
+    Compare two `run` results.
+
+    Returns a list of regressions, as human-readable strings.
+    """
+    bad = []
+    if current.get("scale") != baseline.get("scale"):
+        bad.append(f"scale differs: {current.get('scale')} vs. {baseline.get('scale')}")
+        return bad
+
+    for name,res in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+
+        def check(what, new, old):
+            if new > old*(1+threshold) and new-old >= MIN_DELTA:
+                bad.append(f"{name}: {what} {old:.3f}s → {new:.3f}s (+{(new/old-1)*100 if old else 100:.0f}%)")
+
+        for k in TIMINGS:
+            if k in res and k in base:
+                check(k, res[k], base[k])
+        for phase,(wall,cpu) in res.get("phases", {}).items():
+            if phase in base.get("phases", {}):
+                check(f"{phase} (wall)", wall, base["phases"][phase][0])
+
+        if res["references"] > base["references"]:
+            bad.append(f"{name}: references {base['references']} → {res['references']}")
+        if res["peak_rss"] > base["peak_rss"]*(1+rss_threshold):
+            bad.append(f"{name}: peak RSS {base['peak_rss']>>20} → {res['peak_rss']>>20} MiB")
+    return bad
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import json
+import sys
+from functools import partial
+
+import asyncclick as click
+import trio
+
+from kf2.bench import LOCATIONS, run, compare
+
+@click.command(name="kf2.bench", context_settings={"help_option_names":['-h','-?','--help']})
+@click.option("-l","--location",type=click.Choice(list(LOCATIONS)),multiple=True,help="location(s) to render; default: all")
+@click.option("-s","--load-settings",type=click.Path(exists=True, dir_okay=False), help="load settings file (KFS)")
+@click.option("-S","--scale",type=float,default=1,help="scale the image sizes")
+@click.option("-r","--repeat",type=int,default=1,help="render each location N times, keep the fastest")
+@click.option("-o","--output",type=click.Path(dir_okay=False, readable=False,writable=True), help="write the results to this file")
+@click.option("-b","--baseline",type=click.Path(exists=True, dir_okay=False), help="compare against these results")
+@click.option("-t","--threshold",type=float,default=0.1,help="relative slowdown that counts as a regression")
+@click.option("-L","--log",type=str,help="logging verbosity")
+async def _main(location,load_settings,scale,repeat,output,baseline,threshold,log):
+	res = await trio.to_thread.run_sync(partial(run, location or None, scale=scale, repeat=repeat, settings=load_settings, log_level=log))
+	data = json.dumps(res, indent=1)
+	if output:
+		with open(output,"w") as f:
+			f.write(data)
+	else:
+		print(data)
+
+	if baseline:
+		with open(baseline) as f:
+			base = json.load(f)
+		bad = compare(res, base, threshold=threshold)
+		for b in bad:
+			print(b, file=sys.stderr)
+		if bad:
+			sys.exit(1)
+		print("No regressions.", file=sys.stderr)
+
+if __name__ == "__main__":
+	_main(_anyio_backend="trio")
@@ -0,0 +1,142 @@
+##
+# A cache of render results.
+#
+# Keyed by location/palette text, settings text and image size, it stores
+# copies of the per-pixel buffers. Returning to a view that's in the cache
+# is a buffer copy plus re-colouring instead of a render.
+#
+# Entries are kept in memory up to a budget; the least recently used ones
+# beyond that are spilled to disk, and dropped when the disk budget is
+# exceeded too.
+##
+
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+
+import numpy
+
+BUFFERS = ("iter_lsb", "iter_msb", "trans", "dex", "dey")
+
+
+class _Entry:
+    path = None
+
+    def __init__(self, data:dict, iterations:int):
+        self.data = data
+        self.iterations = iterations
+        self.size = sum(a.nbytes for a in data.values())
+
+
+class RenderCache:
+    """
+    An LRU cache of render results.
+
+    Params:
+        memory: bytes to keep in memory.
+        disk: bytes to keep in the spill directory.
+        path: the spill directory. Default: a temporary directory that's
+              removed when the cache goes away.
+    """
+    def __init__(self, memory:int = 512<<20, disk:int = 4<<30, path:str = None):
+        self.memory = memory
+        self.disk = disk
+        if path is None:
+            path = tempfile.mkdtemp(prefix="kf2-cache-")
+            self._cleanup = weakref.finalize(self, shutil.rmtree, path, True)
+        self.path = path
+        self._entries = OrderedDict()  # key => _Entry; several keys may share one
+        self._n = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kf):
+        return (kf.params_str, kf.settings_str, kf.getImageSize())
+
+    def __len__(self):
+        return len(set(map(id, self._entries.values())))
+
+    def store(self, kf, *keys):
+        """Copy the current render result into the cache, under these keys"""
+        bufs = kf.buffers
+        data = {}
+        for name in BUFFERS:
+            try:
+                data[name] = numpy.array(getattr(bufs, name))
+            except RuntimeError:  # not allocated, e.g. DE without derivatives
+                pass
+        e = _Entry(data, kf.iterations)
+        for key in keys:
+            self._drop(key)
+            self._entries[key] = e
+        self._trim()
+        kf.log("debug", "render cache: stored %d bytes", e.size)
+
+    def restore(self, kf, key) -> bool:
+        """
+        Copy a cached result for `key` into `kf`'s buffers.
+
+        Returns False if there is none.
+        """
+        e = self._entries.get(key)
+        if e is None:
+            self.misses += 1
+            kf.log("info", "render cache miss (%d hits, %d misses)", self.hits, self.misses)
+            return False
+        self._entries.move_to_end(key)
+
+        data = e.data
+        if data is None:
+            with numpy.load(e.path) as f:
+                data = {name:f[name] for name in f.files}
+        bufs = kf.buffers
+        for name,arr in data.items():
+            numpy.asarray(getattr(bufs, name))[...] = arr
+        kf.iterations = e.iterations
+
+        self.hits += 1
+        kf.log("info", "render cache hit (%d hits, %d misses)", self.hits, self.misses)
+        return True
+
+    def clear(self):
+        for key in list(self._entries):
+            self._drop(key)
+
+    def _drop(self, key):
+        e = self._entries.pop(key, None)
+        if e is None or e in self._entries.values():
+            return
+        if e.path is not None:
+            os.unlink(e.path)
+
+    def _trim(self):
+        seen = set()
+        drop = []
+        mem = 0
+        disk = 0
+        for e in reversed(list(self._entries.values())):
+            if id(e) in seen:
+                continue
+            seen.add(id(e))
+            if e.data is not None:
+                if mem + e.size <= self.memory:
+                    mem += e.size
+                    continue
+                self._spill(e)
+            if disk + e.size <= self.disk:
+                disk += e.size
+            else:
+                drop.append(e)
+        for e in drop:
+            for k in [k for k,v in self._entries.items() if v is e]:
+                self._drop(k)
+
+    def _spill(self, e):
+        self._n += 1
+        path = os.path.join(self.path, f"{self._n}.npz")
+        numpy.savez(path, **e.data)
+        e.path = path
+        e.data = None
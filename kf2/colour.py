@@ -0,0 +1,86 @@
+##
+# Colouring without the library.
+#
+# `Colouring` is a colouring scheme that works on a Fraktal's whole
+# iteration, trans and DE buffers at once and writes the bitmap directly.
+# The per-pixel work is done by `kf2.core.colour`, in threads, without the
+# GIL, so new schemes can be prototyped here at native speed.
+#
+# Assign one to `Fractal.colouring` to use it instead of the library's
+# `applyColors`.
+##
+
+import numpy
+
+from .core import colour, colour_transfers
+
+TABLE_SIZE = 1024
+# entries in a palette table, like the library's
+
+
+def palette_table(colors, size:int = TABLE_SIZE):
+    """
+    Interpolate a cyclic palette of (r,g,b) key colours to `size` entries.
+
+    Returns a (size,3) float32 array.
+    """
+    keys = numpy.asarray(colors, numpy.float32).reshape(-1,3)
+    if not len(keys):
+        raise ValueError("no colours")
+    pos = numpy.arange(size) * len(keys) / size
+    i = numpy.floor(pos).astype(numpy.intp)
+    f = (pos-i)[:,None].astype(numpy.float32)
+    return keys[i]*(1-f) + keys[(i+1) % len(keys)]*f
+
+
+class Colouring:
+    """
+    A colouring scheme.
+
+    colors: key colours, as (r,g,b) tuples. Default: the Fraktal's.
+    div: iteration divisor. Default: the Fraktal's.
+    offset: palette offset, in table entries.
+    smooth: use the fractional iteration count.
+    transfer: "linear", "sqrt" or "log", applied before dividing.
+    slope_angle: direction of the light, in degrees, counter-clockwise
+                 from the right.
+    slope_power: slope shading strength; zero turns slopes off.
+    slope_ratio: how much of the colour the slopes may replace, 0…1.
+    de: darken pixels that are closer than this many pixels to the
+        boundary. Needs derivatives.
+    interior: the colour of pixels that reach the iteration limit.
+    threads: see `kf2.core.resample`.
+    """
+    colors = None
+    div:float = None
+    offset:float = 0
+    smooth:bool = True
+    transfer:str = "linear"
+    slope_angle:float = 45
+    slope_power:float = 0
+    slope_ratio:float = 0.5
+    de:float = 0
+    interior:tuple = (0,0,0)
+    threads:int = 0
+
+    def __init__(self, **kw):
+        for k,v in kw.items():
+            if not hasattr(type(self), k):
+                raise TypeError(f"unknown parameter {k !r}")
+            setattr(self, k, v)
+        if self.transfer not in colour_transfers:
+            raise ValueError(f"unknown transfer {self.transfer !r}, use one of {colour_transfers}")
+        if len(self.interior) != 3:
+            raise ValueError(f"the interior colour must be (r,g,b), not {self.interior !r}")
+
+    def table(self, kf=None):
+        """The palette table, see `palette_table`"""
+        return palette_table(kf.key_colors if self.colors is None else self.colors)
+
+    def apply(self, kf):
+        """Colour `kf`'s bitmap"""
+        colour(kf, self.table(kf), div=self.div or kf.iter_div, offset=self.offset,
+                smooth=self.smooth, transfer=self.transfer,
+                slope_angle=self.slope_angle, slope_power=self.slope_power,
+                slope_ratio=self.slope_ratio, de=self.de, interior=self.interior,
+                threads=self.threads)
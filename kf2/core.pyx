@@ -1,17 +1,20 @@
 from cfraktal cimport CFraktalSFT, version
 from cfraktal cimport uint8_t, uint32_t, int32_t, int64_t, uint64_t, bool, string, Reference_Type, CDecNumber
-from cfraktal cimport Differences_Analytic
+from cfraktal cimport Differences_Analytic, EXRChannels, COLOR14, polar2
 from gmpy2 cimport mpfr, MPFR_Check, MPFR, mpfr_t, import_gmpy2, GMPy_MPFR_From_mpfr
 cimport numpy as np
 cimport cython
+from libc.math cimport sqrt, log, fmod, atan, sin, cos, M_PI
 from cython cimport view
+from libcpp.vector cimport vector
 
+import gmpy2
 import numpy
-import cairo
+import os
 import pathlib
+from concurrent.futures import ThreadPoolExecutor
 import PIL
 import PIL.Image
-import PIL.ImageOps
 import sys
 
 
@@ -27,6 +30,27 @@ cdef int32_t UNEVALUATED = 0x80000000
 def flush_mp_cache():
     mpfr_free_cache2(MPFR_FREE_LOCAL_CACHE)
 
+exr_channel_names = ("R","G","B","N","NF","DEX","DEY","T","Preview")
+
+cdef enum:
+    BUF_ITER_LSB = 0
+    BUF_ITER_MSB = 1
+    BUF_TRANS = 2
+    BUF_DEX = 3
+    BUF_DEY = 4
+
+buffer_kinds = {
+    "iter_lsb": BUF_ITER_LSB,
+    "iter_msb": BUF_ITER_MSB,
+    "trans": BUF_TRANS,
+    "dex": BUF_DEX,
+    "dey": BUF_DEY,
+}
+
+class StaleBufferError(RuntimeError):
+    """A pixel buffer view was used after the image was resized."""
+    pass
+
 levels = {
     "debug":0,
     "status":1,
@@ -102,11 +126,51 @@ cdef class Fraktal:
     @property
     def iter_data(self):
         """
-        Return the iter counts as a numpy array.
+        Return the iter counts as a numpy array of uint64, indexed [x,y].
+
+        This is a copy. Use `buffers` for zero-copy access.
+        """
+        return self.buffers.iterations[...]
 
-        TODO this ignores MSB.
+# Pixel buffers
+
+    cdef unsigned long _generation
+    cdef int _exports
+
+    @property
+    def buffers(self):
+        """
+        Zero-copy views of the per-pixel data. See `PixelBuffers`.
         """
-        return np.PyArray_SimpleNewFromData(2,[self.nY,self.nX], np.NPY_UINT32, self.cfr.m_nPixels_LSB).T
+        return PixelBuffers(self)
+
+    @property
+    def buffer_generation(self):
+        """
+        Incremented whenever the pixel buffers may have been reallocated.
+        """
+        return self._generation
+
+    cdef void *_buffer(self, int kind):
+        if kind == BUF_ITER_LSB:
+            return self.cfr.m_nPixels_LSB
+        if kind == BUF_ITER_MSB:
+            return self.cfr.m_nPixels_MSB
+        if kind == BUF_TRANS:
+            return self.cfr.m_nTrans
+        if kind == BUF_DEX:
+            return self.cfr.m_nDEx
+        if kind == BUF_DEY:
+            return self.cfr.m_nDEy
+        return NULL
+
+    def _realloc_buffers(self):
+        """
+        Call before anything that may reallocate the pixel buffers.
+        """
+        if self._exports:
+            raise BufferError("%d pixel buffer export(s) still in use" % (self._exports,))
+        self._generation += 1
 
     def _check_bitmap(self):
         if not self.cfr.m_bmi:
@@ -217,6 +281,7 @@ cdef class Fraktal:
         cdef int x = nx
         cdef int y = ny
 
+        self._realloc_buffers()
         with nogil:
             self.cfr.SetImageSize(x,y)
 
@@ -230,10 +295,33 @@ cdef class Fraktal:
     # void Zoom(int nXPos, int nYPos, double nZoomSize, int nWidth, int nHeight, bool bReuseCenter = FALSE, bool autoRender = true)
     # bool Center(int &rx, int &ry, bool bSkipM = FALSE, bool bQuick = FALSE)
     # double GetProgress(double *reference = nullptr, double *approximation = nullptr, double *good_guessed = nullptr, double *good = nullptr, double *queued = nullptr, double *bad = nullptr, double *bad_guessed = nullptr)
+    def getProgress(self):
+        """
+        Return the render progress, as a dict of percentages.
+        """
+        cdef double ref=0, approx=0, good_guessed=0, good=0, queued=0, bad=0, bad_guessed=0
+        cdef double total
+        total = self.cfr.GetProgress(&ref, &approx, &good_guessed, &good, &queued, &bad, &bad_guessed)
+        return dict(total=total, reference=ref, approximation=approx,
+                good_guessed=good_guessed, good=good, queued=queued,
+                bad=bad, bad_guessed=bad_guessed)
+
     def resetTimers(self):
         self.cfr.ResetTimers()
 
     # void GetTimers(double *total_wall, double *total_cpu = nullptr, double *reference_wall = nullptr, double *reference_cpu = nullptr, double *approximation_wall = nullptr, double *approximation_cpu = nullptr, double *perturbation_wall = nullptr, double *perturbation_cpu = nullptr)
+    def getTimers(self):
+        """
+        Return the render timers since `resetTimers`, as a dict of
+        seconds: {total,reference,approximation,perturbation}_{wall,cpu}.
+        """
+        cdef double tw=0, tc=0, rw=0, rc=0, aw=0, ac=0, pw=0, pc=0
+        self.cfr.GetTimers(&tw, &tc, &rw, &rc, &aw, &ac, &pw, &pc)
+        return dict(total_wall=tw, total_cpu=tc,
+                reference_wall=rw, reference_cpu=rc,
+                approximation_wall=aw, approximation_cpu=ac,
+                perturbation_wall=pw, perturbation_cpu=pc)
+
     # string GetPosition()
 
     # void GetIterations(int64_t &nMin, int64_t &nMax, int *pnCalculated = NULL, int *pnType = NULL, bool bSkipMaxIter = FALSE)
@@ -272,13 +360,16 @@ cdef class Fraktal:
     # int GetNumOfColors()
     def applyColors(self):
         """ Calculate m_cPos, run OpenGL / CPU coloring"""
-        self.cfr.ApplyColors()
+        with nogil:
+            self.cfr.ApplyColors()
     def setColor(self, x:int, y:int, w:int=1, h:int=1):
         """ CPU coloring of a single pixel"""
         self.cfr.SetColor(x,y,w,h)
     def applyColorRange(self, x0:int, x1:int, y0:int, y1:int):
         """ CPU coloring of a single range, one 16x16 square at a time"""
-        self.cfr.ApplyColors(x0,x1,y0,y1)
+        cdef int xa=x0, xb=x1, ya=y0, yb=y1
+        with nogil:
+            self.cfr.ApplyColors(xa,xb,ya,yb)
 
     # void ApplyIterationColors()
     # void ApplyPhaseColors()
@@ -286,6 +377,27 @@ cdef class Fraktal:
     # int GetSeed()
     # COLOR14 GetKeyColor(int i)
     # void SetKeyColor(COLOR14 col, int i)
+
+    @property
+    def key_colors(self):
+        """The palette's key colours, as a list of (r,g,b) tuples"""
+        cdef COLOR14 c
+        res = []
+        for i in range(self.cfr.GetNumOfColors()):
+            c = self.cfr.GetKeyColor(i)
+            res.append((c.r,c.g,c.b))
+        return res
+    @key_colors.setter
+    def key_colors(self, colors):
+        cdef COLOR14 c
+        colors = list(colors)
+        self.cfr.ChangeNumOfColors(len(colors))
+        for i,(r,g,b) in enumerate(colors):
+            c.r = r
+            c.g = g
+            c.b = b
+            self.cfr.SetKeyColor(c, i)
+
     # COLOR14 GetColor(int i)
     # COLOR14 GetInteriorColor()
     # void SetInteriorColor(COLOR14 &c)
@@ -294,23 +406,54 @@ cdef class Fraktal:
     # bool OpenString(string &szText, bool bNoLocation = FALSE)
 
     def openFile(self, filename:str, noLocation:bool=False):
-        if not self.cfr.OpenFile(fnfix(filename), noLocation):
+        cdef string fn = fnfix(filename)
+        cdef bool nl = noLocation
+        cdef bool ok
+        with nogil:
+            ok = self.cfr.OpenFile(fn, nl)
+        if not ok:
             raise RuntimeError("Could not open %s" % (repr(filename)))
         if self.cfr.GetDifferences() == Differences_Analytic and not self.derivatives:
             self.log("warn","automatically enabling derivatives for analytic DE")
             self.derivatives = True
 
+    def openString(self, text:str, noLocation:bool=False):
+        cdef string txt = text.encode("utf-8")
+        cdef bool nl = noLocation
+        cdef bool ok
+        with nogil:
+            ok = self.cfr.OpenString(txt, nl)
+        if not ok:
+            raise RuntimeError("Not recognized")
+        if self.cfr.GetDifferences() == Differences_Analytic and not self.derivatives:
+            self.log("warn","automatically enabling derivatives for analytic DE")
+            self.derivatives = True
+
     def openMapB(self, filename:str, reuseCenter:bool=False, zoomSize:float=1):
-        if not self.cfr.OpenMapB(fnfix(filename), reuseCenter, zoomSize):
+        cdef string fn = fnfix(filename)
+        cdef bool rc = reuseCenter
+        cdef double zs = zoomSize
+        cdef bool ok
+        self._realloc_buffers()
+        with nogil:
+            ok = self.cfr.OpenMapB(fn, rc, zs)
+        if not ok:
             raise RuntimeError("Could not open %s" % (repr(filename)))
 
     def openMapEXR(self, filename:str):
-        if not self.cfr.OpenMapEXR(fnfix(filename)):
+        cdef string fn = fnfix(filename)
+        cdef bool ok
+        self._realloc_buffers()
+        with nogil:
+            ok = self.cfr.OpenMapEXR(fn)
+        if not ok:
             raise RuntimeError("Could not open %s" % (repr(filename)))
 
     def openMap(self, filename:str):
-        if not self.cfr.OpenMapB(fnfix(filename), False,1):
-            self.OpenMapEXR(filename)
+        try:
+            self.openMapB(filename)
+        except RuntimeError:
+            self.openMapEXR(filename)
 
     # bool OpenMapEXR(string &szFile)
     # string ToText()
@@ -318,58 +461,268 @@ cdef class Fraktal:
     # double GetIterDiv()
     # void SetIterDiv(double nIterDiv)
 
-    @cython.boundscheck(False)
-    @cython.wraparound(False)
-    def saveEXR(self, filename:str):
-        cdef uint8_t[:,:,::1] img = self.image_data_rgba
-        cdef np.ndarray[np.uint8_t, ndim=3, mode='c'] rgb = numpy.empty((self.nY,self.nX,3), numpy.ubyte, 'C')
-        cdef uint32_t x,y,xx,yy
+    @property
+    def iter_div(self):
+        return self.cfr.GetIterDiv()
+    @iter_div.setter
+    def iter_div(self, value:float):
+        self.cfr.SetIterDiv(value)
 
-        if not self.cfr.GetHalfColour():
-            self.cfr.SetHalfColour(True)
-            self.cfr.ApplyColors()
+    @property
+    def exr_channels(self):
+        """
+        The channels written by `saveEXR`, as a dict of flags.
 
-        yy=self.nY
-        xx=self.nX
-        for y in range(yy):
-            for x in range(xx):
-                rgb[y][x][0] = img[y][x][2]
-                rgb[y][x][1] = img[y][x][1]
-                rgb[y][x][2] = img[y][x][0]
+        R, G, B: colour; N: integer iteration count; NF: fractional
+        iteration count; DEX, DEY: distance estimate; T: phase;
+        Preview: 8-bit thumbnail.
+        """
+        cdef EXRChannels c = self.cfr.GetEXRChannels()
+        return dict(R=c.R, G=c.G, B=c.B, N=c.N, NF=c.NF,
+                DEX=c.DEX, DEY=c.DEY, T=c.T, Preview=c.Preview)
+    @exr_channels.setter
+    def exr_channels(self, chans):
+        """
+        Accepts a dict of flags, or an iterable of channel names.
+        """
+        cdef EXRChannels c
+        if not isinstance(chans, dict):
+            chans = {k:True for k in chans}
+        for k in chans:
+            if k not in exr_channel_names:
+                raise KeyError(k)
+        c.R = chans.get("R", False)
+        c.G = chans.get("G", False)
+        c.B = chans.get("B", False)
+        c.N = chans.get("N", False)
+        c.NF = chans.get("NF", False)
+        c.DEX = chans.get("DEX", False)
+        c.DEY = chans.get("DEY", False)
+        c.T = chans.get("T", False)
+        c.Preview = chans.get("Preview", False)
+        self.cfr.SetEXRChannels(c)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def saveEXR(self, filename:str, channels=None, half:bool=True):
+        """
+        Save an EXR file.
+
+        Params:
+            channels: override `exr_channels` for this file.
+            half: if the colour channels are written and the bitmap has
+                  not been coloured with half-float precision, switch on
+                  `half_colour` and re-colour. Set `half_colour` before
+                  colouring to avoid the second pass, or pass False to
+                  write the 8-bit colours as they are.
+
+        Data-only channel sets (N, NF, DEX, DEY, T) neither re-colour
+        nor touch the bitmap.
+        """
+        cdef EXRChannels saved = self.cfr.GetEXRChannels()
+        if channels is not None:
+            self.exr_channels = channels
+        try:
+            self._saveEXR(filename, half)
+        finally:
+            if channels is not None:
+                self.cfr.SetEXRChannels(saved)
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def _saveEXR(self, filename:str, half:bool):
+        cdef EXRChannels c = self.cfr.GetEXRChannels()
+        cdef uint8_t[:,:,::1] img
+        cdef uint8_t[:,:,::1] rgb
+        cdef Py_ssize_t x,y,xx,yy
+        cdef np.uint8_t* rgbd = NULL
         cdef string cmt
-        cdef np.uint8_t* rgbd = &rgb[0,0,0]
-        self.cfr.SaveEXR(fnfix(filename),rgbd, self.nX,self.nY,cmt,1)
+        cdef string fn = fnfix(filename)
+
+        if c.R or c.G or c.B or c.Preview:
+            if half and (c.R or c.G or c.B) and not self.cfr.GetHalfColour():
+                self.cfr.SetHalfColour(True)
+                with nogil:
+                    self.cfr.ApplyColors()
+
+            # BGRX to RGB in one pass, without the GIL
+            img = self.image_data_rgba
+            yy = img.shape[0]
+            xx = img.shape[1]
+            rgb = numpy.empty((yy,xx,3), numpy.ubyte, 'C')
+            with nogil:
+                for y in range(yy):
+                    for x in range(xx):
+                        rgb[y,x,0] = img[y,x,2]
+                        rgb[y,x,1] = img[y,x,1]
+                        rgb[y,x,2] = img[y,x,0]
+            rgbd = &rgb[0,0,0]
+        # else the library doesn't look at the bitmap at all
+
+        cdef int nX = self.nX, nY = self.nY
+        with nogil:
+            self.cfr.SaveEXR(fn, rgbd, nX,nY,cmt,1)
 
     def saveKFR(self, filename:str):
-        self.cfr.SaveFile(fnfix(filename), True)
+        cdef string fn = fnfix(filename)
+        with nogil:
+            self.cfr.SaveFile(fn, True)
     def saveMap(self, filename:str):
-        self.cfr.SaveMapB(fnfix(filename))
+        cdef string fn = fnfix(filename)
+        with nogil:
+            self.cfr.SaveMapB(fn)
 
     @property
     def pilImage(self):
-        img = cairo.ImageSurface.create_for_data(self.image_bytes, cairo.FORMAT_RGB24, self.image_width, self.image_height)
-
-        cairoFormat = img.get_format()
-        if cairoFormat == cairo.FORMAT_ARGB32 or cairoFormat == cairo.FORMAT_RGB24:
-            # Cairo has ARGB. Convert this to RGB for PIL which supports only RGB or RGBA.
-            pilMode = 'RGB'
-            argbArray = self.image_bytes.reshape( -1, 4 )
-            rgbArray = argbArray[ :, 2::-1 ]
-            pilData = rgbArray.reshape( -1 )
-        else:
-            raise ValueError( 'Unsupported cairo format: %d' % cairoFormat )
-        pilImage = PIL.Image.frombuffer(pilMode,
-                ( img.get_width(), img.get_height() ), pilData, "raw",
-                pilMode, 0, 1 )
-        pilImage = pilImage.convert( 'RGB' )
-        pilImage = PIL.ImageOps.flip(pilImage)
-        return pilImage
+        """
+        The image, as an RGB PIL image.
+
+        PIL decodes the bottom-up BGRX bitmap directly; this is the only
+        copy.
+        """
+        self._check_bitmap()
+        return PIL.Image.frombuffer("RGB", (self.cfr.m_bmi.biWidth, self.cfr.m_bmi.biHeight),
+                self.image_bytes, "raw", "BGRX", 0, -1)
+
+    @property
+    def rgb_view(self):
+        """
+        The image as a top-down (height,width,3) RGB numpy array.
+
+        This is a view of the bitmap, not a copy; it's not contiguous.
+        """
+        return self.image_data_rgba[::-1, :, 2::-1]
+
+    def downscale(self, int width, int height, str filter="area", int threads=0):
+        """
+        Return the image, resampled to `width`×`height`, as a numpy array
+        laid out like `image_data_rgba`.
+
+        filter: "box", "area" or "lanczos".
+        threads: see `resample`.
+        """
+        self._check_bitmap()
+        return resample(self.image_data_rgba, width, height, filter, threads)
 
     # int64_t GetMaxApproximation()
     # int64_t GetIterationOnPoint(int x, int y)
     # double GetTransOnPoint(int x, int y)
 
+    def _pixels(self, x, y):
+        """
+        Broadcast pixel coordinates to flat int arrays. Returns x, y and
+        the result shape.
+        """
+        x,y = numpy.broadcast_arrays(numpy.asarray(x), numpy.asarray(y))
+        shape = x.shape
+        x = numpy.ascontiguousarray(x.ravel(), numpy.intc)
+        y = numpy.ascontiguousarray(y.ravel(), numpy.intc)
+        if len(x) and (x.min() < 0 or x.max() >= self.nX or y.min() < 0 or y.max() >= self.nY):
+            raise IndexError("pixel outside the %dx%d image" % (self.nX, self.nY))
+        return x,y,shape
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def iterations_at(self, x, y):
+        """
+        The iteration counts at these pixels, as an int64 array.
+
+        x, y: integer arrays of pixel coordinates, or anything else numpy
+        can broadcast.
+        """
+        xa,ya,shape = self._pixels(x,y)
+        res = numpy.empty(len(xa), numpy.int64)
+        cdef const int[::1] xv = xa
+        cdef const int[::1] yv = ya
+        cdef np.int64_t[::1] rv = res
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(xv.shape[0]):
+                rv[i] = self.cfr.GetIterationOnPoint(xv[i], yv[i])
+        return res.reshape(shape)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def trans_at(self, x, y):
+        """
+        The fractional iteration parts at these pixels, as a float64
+        array. Negative for glitched pixels.
+
+        x, y: see `iterations_at`.
+        """
+        xa,ya,shape = self._pixels(x,y)
+        res = numpy.empty(len(xa), numpy.float64)
+        cdef const int[::1] xv = xa
+        cdef const int[::1] yv = ya
+        cdef double[::1] rv = res
+        cdef Py_ssize_t i
+        with nogil:
+            for i in range(xv.shape[0]):
+                rv[i] = self.cfr.GetTransOnPoint(xv[i], yv[i])
+        return res.reshape(shape)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def coords_at(self, x, y):
+        """
+        The exact coordinates of these pixels, as two arrays of mpfr
+        numbers (real and imaginary part), with the center's precision.
+
+        x, y: see `iterations_at`.
+        """
+        xa,ya,shape = self._pixels(x,y)
+        cdef const int[::1] xv = xa
+        cdef const int[::1] yv = ya
+        cdef int w = self.nX, h = self.nY
+        cdef Py_ssize_t i, n = xv.shape[0]
+        cdef vector[string] re, im
+        re.resize(n)
+        im.resize(n)
+        with nogil:
+            for i in range(n):
+                re[i] = self.cfr.GetRe(xv[i], yv[i], w, h)
+                im[i] = self.cfr.GetIm(xv[i], yv[i], w, h)
+
+        prec = self._center_re().precision
+        res_re = numpy.empty(n, object)
+        res_im = numpy.empty(n, object)
+        for i in range(n):
+            res_re[i] = gmpy2.mpfr(re[i].decode("ascii"), prec)
+            res_im[i] = gmpy2.mpfr(im[i].decode("ascii"), prec)
+        return res_re.reshape(shape), res_im.reshape(shape)
+
+    def offsets_at(self, x, y):
+        """
+        The coordinates of these pixels relative to the center, as two
+        float64 arrays (real and imaginary part) in units of the zoom
+        radius, and that radius, as mpfr.
+
+        The offsets themselves are `re*radius`: past 1e308 they don't fit
+        a float64, while the scaled ones always do.
+
+        The pixel grid is linear (possibly rotated or skewed), so only
+        three points are converted at full precision. With
+        `exponential_map` it's not; then every point is.
+
+        x, y: see `iterations_at`.
+        """
+        xa,ya,shape = self._pixels(x,y)
+        cre = self._center_re()
+        cim = self._center_im()
+        radius = self._zoom_radius()
+        if self.exponential_map:
+            re,im = self.coords_at(xa,ya)
+            re = numpy.array([float((r-cre)/radius) for r in re])
+            im = numpy.array([float((i-cim)/radius) for i in im])
+        else:
+            re,im = self.coords_at([0,1,0], [0,0,1])
+            re0, im0 = float((re[0]-cre)/radius), float((im[0]-cim)/radius)
+            dre_x, dim_x = float((re[1]-re[0])/radius), float((im[1]-im[0])/radius)
+            dre_y, dim_y = float((re[2]-re[0])/radius), float((im[2]-im[0])/radius)
+            re = re0 + dre_x*xa + dre_y*ya
+            im = im0 + dim_x*xa + dim_y*ya
+        return re.reshape(shape), im.reshape(shape), radius
+
     # bool AddReference(int x, int y, bool bEraseAll = FALSE, bool bResuming = FALSE)
     def addReference(self, x:int, y:int, eraseAll:bool=False, resuming:bool=False):
         """Sets the reference r+i values to these coordinates"""
@@ -390,6 +743,31 @@ cdef class Fraktal:
         self.cfr.m_bAddReference = num
 
 
+    def markUnevaluated(self):
+        """
+        Flag the pixels that a stopped render didn't get to as glitched, so
+        that a render with `add_references` set calculates only those.
+
+        Returns their number.
+        """
+        cdef uint32_t *lsb = self.cfr.m_nPixels_LSB
+        cdef uint32_t *msb = self.cfr.m_nPixels_MSB
+        cdef float *trans = self.cfr.m_nTrans
+        cdef Py_ssize_t i, n = <Py_ssize_t>self.nX * self.nY
+        cdef Py_ssize_t count = 0
+        if lsb == NULL or trans == NULL:
+            raise RuntimeError("no data")
+        # the MSB half of a 64-bit UNEVALUATED is its sign extension
+        with nogil:
+            for i in range(n):
+                if <int32_t>lsb[i] != UNEVALUATED:
+                    continue
+                if msb != NULL and <unsigned int>msb[i] != 0xFFFFFFFFU:
+                    continue
+                trans[i] = -1
+                count += 1
+        return count
+
     # bool HighestIteration(int &rx, int &ry)
     # void IgnoreIsolatedGlitches()
 
@@ -408,6 +786,19 @@ cdef class Fraktal:
             return None
         return (x,y,r)
 
+    def findGlitchCenters(self, int limit=16):
+        """
+        Finds the centers of up to `limit` separate glitches, in a single
+        scan of the glitch flags. See `glitch_centers`.
+
+        Returns a list of (x,y,size) tuples, largest glitch first.
+        """
+        cdef float *trans = self.cfr.m_nTrans
+        cdef Py_ssize_t nX = self.nX, nY = self.nY
+        if trans == NULL:
+            raise RuntimeError("no data")
+        return glitch_centers(<float[:nX,:nY]>trans, limit)
+
     # void FindCenterOfGlitch(int x0, int x1, int y0, int y1, TH_FIND_CENTER *p)
     # int GetColorIndex(int x, int y)
     # bool GetFlat()
@@ -434,6 +825,13 @@ cdef class Fraktal:
     # double GetBailoutNorm()
     # int GetPower()
     # void SetPower(int nPower)
+    @property
+    def power(self):
+        return self.cfr.GetPower()
+    @power.setter
+    def power(self, value:int):
+        self.cfr.SetPower(value)
+
     # void SetColorMethod(int nColorMethod)
     # ColorMethod GetColorMethod()
     # void SetDifferences(int nDifferences)
@@ -458,6 +856,13 @@ cdef class Fraktal:
     # int64_t GetMaxExceptCenter()
     # void SetFractalType(int nFractalType)
     # int GetFractalType()
+    @property
+    def fractal_type(self):
+        return self.cfr.GetFractalType()
+    @fractal_type.setter
+    def fractal_type(self, value:int):
+        self.cfr.SetFractalType(value)
+
 
     # int GetExponent()
 
@@ -485,18 +890,34 @@ cdef class Fraktal:
         """
         Read a .kfr (or other saved settings) file
         """
-        if not self.cfr.OpenSettings(fnfix(filename)):
+        cdef string fn = fnfix(filename)
+        cdef bool ok
+        with nogil:
+            ok = self.cfr.OpenSettings(fn)
+        if not ok:
             raise RuntimeError("Could not open %s" % (repr(filename)))
 
     def saveSettings(self, filename:str, overwrite: bool=True):
         """
         Save the current state to a .kfr file
         """
-        if not self.cfr.SaveSettings(fnfix(filename), overwrite):
+        cdef string fn = fnfix(filename)
+        cdef bool ow = overwrite
+        cdef bool ok
+        with nogil:
+            ok = self.cfr.SaveSettings(fn, ow)
+        if not ok:
             raise RuntimeError("Could not save %s" % (repr(filename)))
 
     # void SetTransformPolar(polar2 &P)
     # polar2 GetTransformPolar()
+
+    @property
+    def transform_polar(self):
+        """The view's transformation: (sign, scale, rotate, stretch_factor, stretch_angle)"""
+        cdef polar2 p = self.cfr.GetTransformPolar()
+        return (p.sign, p.scale, p.rotate, p.stretch_factor, p.stretch_angle)
+
     # void SetTransformMatrix(mat2 &M)
     # mat2 GetTransformMatrix()
 
@@ -697,18 +1118,32 @@ cdef class Fraktal:
     # TODO export them as a mapping, as soon as the library supports that
     @property
     def settings_str(self):
-        return self.cfr.GetSettings().decode("utf-8")
+        cdef string res
+        with nogil:
+            res = self.cfr.GetSettings()
+        return res.decode("utf-8")
     @settings_str.setter
     def settings_str(self, data):
-        if not self.cfr.SetSettings(data.encode("utf-8")):
+        cdef string txt = data.encode("utf-8")
+        cdef bool ok
+        with nogil:
+            ok = self.cfr.SetSettings(txt)
+        if not ok:
             raise RuntimeError("Not recognized")
 
     @property
     def params_str(self):
-        return self.cfr.ToText().decode("utf-8")
+        cdef string res
+        with nogil:
+            res = self.cfr.ToText()
+        return res.decode("utf-8")
     @params_str.setter
     def params_str(self, data):
-        if not self.cfr.OpenString(data.encode("utf-8"), True):
+        cdef string txt = data.encode("utf-8")
+        cdef bool ok
+        with nogil:
+            ok = self.cfr.OpenString(txt, True)
+        if not ok:
             raise RuntimeError("Not recognized")
 
     @property
@@ -918,5 +1353,616 @@ cdef class Fraktal:
         x,y,z = xyz
         self.cfr.SetTargetDimensions(x,y,z)
 
+cdef class PixelBuffer:
+    """
+    A zero-copy view of one of a Fraktal's per-pixel buffers.
+
+    Supports the buffer protocol, so `numpy.asarray(buf)` doesn't copy.
+    Like KF itself, the data are indexed [x,y].
+
+    The view is tied to the buffer generation it was created in. Using it
+    after the image has been resized raises `StaleBufferError`. Conversely,
+    resizing the image while any export (e.g. a numpy array made from
+    this view) is alive raises `BufferError`.
+    """
+    cdef Fraktal fr
+    cdef int kind
+    cdef readonly str name
+    cdef readonly unsigned long generation
+    cdef Py_ssize_t shape[2]
+    cdef Py_ssize_t strides[2]
+
+    def __cinit__(self, Fraktal fr, str name):
+        self.fr = fr
+        self.name = name
+        self.kind = buffer_kinds[name]
+        self.generation = fr._generation
+
+    def __repr__(self):
+        return "<PixelBuffer %s gen=%d%s>" % (self.name, self.generation, " STALE" if self.is_stale else "")
+
+    @property
+    def is_stale(self):
+        return self.generation != self.fr._generation
+
+    @property
+    def array(self):
+        """The buffer as a numpy array."""
+        return numpy.asarray(self)
+
+    def __array__(self, dtype=None, copy=None):
+        # numpy silently falls back to an object scalar if __getbuffer__
+        # fails; going through memoryview propagates the error instead.
+        # NumPy 2 doesn't copy what this returns, even for numpy.array().
+        if copy:
+            return numpy.array(memoryview(self), dtype=dtype)
+        res = numpy.asarray(memoryview(self))
+        if dtype is not None and res.dtype != dtype:
+            if copy is False:
+                raise ValueError("%s: converting to %s needs a copy" % (self.name, dtype))
+            res = res.astype(dtype)
+        return res
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        cdef void *ptr
+        cdef Py_ssize_t itemsize = 4
+
+        if self.generation != self.fr._generation:
+            raise StaleBufferError("%s: buffers have been reallocated" % (self.name,))
+        ptr = self.fr._buffer(self.kind)
+        if ptr == NULL:
+            raise RuntimeError("%s: no data" % (self.name,))
+
+        self.shape[0] = self.fr.cfr.GetImageWidth()
+        self.shape[1] = self.fr.cfr.GetImageHeight()
+        self.strides[0] = itemsize*self.shape[1]
+        self.strides[1] = itemsize
+
+        buffer.buf = ptr
+        buffer.format = "I" if self.kind <= BUF_ITER_MSB else "f"
+        buffer.internal = NULL
+        buffer.itemsize = itemsize
+        buffer.len = itemsize*self.shape[0]*self.shape[1]
+        buffer.ndim = 2
+        buffer.obj = self
+        buffer.readonly = 0
+        buffer.shape = self.shape
+        buffer.strides = self.strides
+        buffer.suboffsets = NULL
+        self.fr._exports += 1
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        self.fr._exports -= 1
+
+
+class IterationCounts:
+    """
+    The 64-bit iteration counts, combined from the LSB and MSB buffers
+    on demand. Index it like a numpy array; only the selected part is
+    combined.
+    """
+    def __init__(self, lsb:PixelBuffer, msb:PixelBuffer):
+        self.lsb = lsb
+        self.msb = msb
+
+    @property
+    def shape(self):
+        return numpy.asarray(self.lsb).shape
+
+    def __getitem__(self, key):
+        lo = numpy.asarray(self.lsb)[key]
+        hi = numpy.asarray(self.msb)[key]
+        res = hi.astype(numpy.uint64)
+        res <<= 32
+        res |= lo
+        return res
+
+    def __array__(self, dtype=None, copy=None):
+        res = self[...]
+        if dtype is not None:
+            res = res.astype(dtype)
+        return res
+
+
+class PixelBuffers:
+    """
+    Zero-copy access to a Fraktal's per-pixel data.
+
+    iter_lsb, iter_msb: the two halves of the iteration counts (uint32)
+    iterations: the combined 64-bit counts, computed on access
+    trans: the fractional iteration part (float32)
+    dex, dey: the distance estimate (float32), if derivatives are on
+    """
+    def __init__(self, fr:Fraktal):
+        self.iter_lsb = PixelBuffer(fr, "iter_lsb")
+        self.iter_msb = PixelBuffer(fr, "iter_msb")
+        self.trans = PixelBuffer(fr, "trans")
+        self.dex = PixelBuffer(fr, "dex")
+        self.dey = PixelBuffer(fr, "dey")
+        self.iterations = IterationCounts(self.iter_lsb, self.iter_msb)
+
+    @property
+    def generation(self):
+        return self.iter_lsb.generation
+
+
+##
+# Glitch centers.
+#
+# Glitches are flood-filled, 4-connected. Within each, a second BFS starts
+# at its edge (pixels next to a good one, or on the image border) and
+# walks inwards; the last pixels it reaches are the glitch's center.
+##
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def glitch_centers(const float[:,::1] trans_, int limit=16):
+    """
+    Finds the centers of up to `limit` separate glitches in a trans
+    buffer, x-major like `Fraktal.buffers`. Glitched pixels are negative.
+
+    The center of a glitch is the pixel farthest from its edge (in
+    4-connected steps), so that a new reference lands well inside even
+    a thin or curved glitch. Ties go to the pixel closest to the
+    glitch's centroid.
+    Returns a list of (x,y,size) tuples, largest glitch first.
+    """
+    cdef Py_ssize_t nX = trans_.shape[0], nY = trans_.shape[1]
+    cdef Py_ssize_t n = nX*nY
+    if limit < 1 or n == 0:
+        return []
+    cdef const float *trans = &trans_[0,0]
+
+    seen_a = numpy.zeros(n, numpy.uint8)
+    queue_a = numpy.empty(n, numpy.intp)
+    edge_a = numpy.empty(n, numpy.intp)
+    dist_a = numpy.empty(n, numpy.intc)
+    res = numpy.zeros((limit,3), numpy.intp)
+    cdef unsigned char[::1] seen = seen_a
+    cdef Py_ssize_t[::1] queue = queue_a
+    cdef Py_ssize_t[::1] edge = edge_a
+    cdef int[::1] dist = dist_a
+    cdef Py_ssize_t[:,::1] best = res
+    cdef Py_ssize_t nfound = 0
+    cdef Py_ssize_t i,j,k,p,x,y,head,tail,ehead,etail,c,nnb
+    cdef double sx,sy,cx,cy,d,bestd
+    cdef Py_ssize_t nb[4]
+    cdef int maxd
+
+    with nogil:
+        for i in range(n):
+            if seen[i] or not trans[i] < 0:
+                continue
+            # flood-fill this glitch
+            seen[i] = 1
+            queue[0] = i
+            head = 0
+            tail = 1
+            sx = sy = 0
+            while head < tail:
+                j = queue[head]
+                head += 1
+                x = j // nY
+                y = j % nY
+                sx += x
+                sy += y
+                nnb = _neighbours(j, x, y, nX, nY, nb)
+                for p in range(nnb):
+                    k = nb[p]
+                    if not seen[k] and trans[k] < 0:
+                        seen[k] = 1
+                        queue[tail] = k
+                        tail += 1
+
+            if nfound == limit and tail <= best[limit-1,2]:
+                continue
+
+            # distance from the edge: BFS inwards from the pixels
+            # next to a good one or on the image border
+            etail = 0
+            for head in range(tail):
+                j = queue[head]
+                x = j // nY
+                y = j % nY
+                dist[j] = -1
+                if _neighbours(j, x, y, nX, nY, nb) < 4:
+                    dist[j] = 0
+                else:
+                    for p in range(4):
+                        if not trans[nb[p]] < 0:
+                            dist[j] = 0
+                            break
+                if dist[j] == 0:
+                    edge[etail] = j
+                    etail += 1
+            ehead = 0
+            while ehead < etail:
+                j = edge[ehead]
+                ehead += 1
+                nnb = _neighbours(j, j // nY, j % nY, nX, nY, nb)
+                for p in range(nnb):
+                    k = nb[p]
+                    if trans[k] < 0 and dist[k] < 0:
+                        dist[k] = dist[j]+1
+                        edge[etail] = k
+                        etail += 1
+
+            # the farthest pixels are the last ones found
+            cx = sx/tail
+            cy = sy/tail
+            maxd = dist[edge[etail-1]]
+            c = i
+            bestd = -1
+            ehead = etail
+            while ehead > 0 and dist[edge[ehead-1]] == maxd:
+                ehead -= 1
+                j = edge[ehead]
+                d = (j//nY - cx)**2 + (j%nY - cy)**2
+                if bestd < 0 or d < bestd:
+                    bestd = d
+                    c = j
+
+            # insert, sorted by size
+            if nfound < limit:
+                nfound += 1
+            p = nfound-1
+            while p > 0 and best[p-1,2] < tail:
+                best[p,0] = best[p-1,0]
+                best[p,1] = best[p-1,1]
+                best[p,2] = best[p-1,2]
+                p -= 1
+            best[p,0] = c // nY
+            best[p,1] = c % nY
+            best[p,2] = tail
+
+    return [tuple(r) for r in res[:nfound].tolist()]
+
+cdef inline Py_ssize_t _neighbours(Py_ssize_t j, Py_ssize_t x, Py_ssize_t y,
+        Py_ssize_t nX, Py_ssize_t nY, Py_ssize_t *nb) noexcept nogil:
+    # the 4-connected neighbours of pixel j=(x,y) that are inside the image
+    cdef Py_ssize_t m = 0
+    if x > 0:
+        nb[m] = j-nY
+        m += 1
+    if x < nX-1:
+        nb[m] = j+nY
+        m += 1
+    if y > 0:
+        nb[m] = j-1
+        m += 1
+    if y < nY-1:
+        nb[m] = j+1
+        m += 1
+    return m
+
+
+##
+# Resampling.
+#
+# The filter is separable: for every output row (column) there's a list of
+# source rows (columns) and their weights. Each output row is the weighted
+# sum of its source rows, resampled horizontally.
+##
+
+resample_filters = ("box", "area", "lanczos")
+
+def _resample_weights(int n_in, int n_out, str filter):
+    """
+    Source indices and weights for resampling `n_in` pixels to `n_out`.
+
+    Returns two (n_out, taps) arrays; unused taps have zero weight.
+    """
+    scale = n_in / n_out
+    i = numpy.arange(n_out)
+    if filter == "box":
+        lo = numpy.floor(i*scale).astype(numpy.intp)
+        hi = numpy.maximum(numpy.floor((i+1)*scale).astype(numpy.intp), lo+1)
+        taps = int((hi-lo).max())
+        idx = lo[:,None] + numpy.arange(taps)[None,:]
+        wt = (idx < hi[:,None]).astype(numpy.float32)
+    elif filter == "area":
+        lo = i*scale
+        hi = (i+1)*scale
+        taps = int(numpy.ceil(scale))+1
+        idx = numpy.floor(lo).astype(numpy.intp)[:,None] + numpy.arange(taps)[None,:]
+        wt = (numpy.minimum(idx+1, hi[:,None]) - numpy.maximum(idx, lo[:,None])).clip(0)
+    elif filter == "lanczos":
+        a = 3
+        f = max(scale, 1)
+        center = (i+.5)*scale
+        taps = int(numpy.ceil(2*a*f))+1
+        idx = numpy.floor(center-a*f).astype(numpy.intp)[:,None] + numpy.arange(taps)[None,:]
+        wt = numpy.sinc((idx+.5-center[:,None])/f) * numpy.sinc((idx+.5-center[:,None])/f/a)
+        wt[numpy.abs(idx+.5-center[:,None]) >= a*f] = 0
+    else:
+        raise ValueError(f"unknown filter {filter !r}, use one of {resample_filters}")
+
+    wt[(idx < 0) | (idx >= n_in)] = 0
+    idx = idx.clip(0, n_in-1)
+    wt = wt / wt.sum(axis=1, keepdims=True)
+    return numpy.ascontiguousarray(idx, numpy.intp), numpy.ascontiguousarray(wt, numpy.float32)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef void _resample_rows(const unsigned char[:,:,::1] src, unsigned char[:,:,::1] dst,
+        const Py_ssize_t[:,::1] yi, const float[:,::1] yw,
+        const Py_ssize_t[:,::1] xi, const float[:,::1] xw,
+        float[:,::1] tmp, Py_ssize_t r0, Py_ssize_t r1) noexcept nogil:
+    cdef Py_ssize_t y,x,k,c,j
+    cdef float w, acc
+    for y in range(r0, r1):
+        for x in range(src.shape[1]):
+            for c in range(3):
+                tmp[x,c] = 0
+        for k in range(yi.shape[1]):
+            w = yw[y,k]
+            if w == 0:
+                continue
+            j = yi[y,k]
+            for x in range(src.shape[1]):
+                for c in range(3):
+                    tmp[x,c] += w*src[j,x,c]
+        for x in range(dst.shape[1]):
+            for c in range(3):
+                acc = 0.5
+                for k in range(xi.shape[1]):
+                    acc += xw[x,k]*tmp[xi[x,k],c]
+                if acc < 0:
+                    acc = 0
+                elif acc > 255:
+                    acc = 255
+                dst[y,x,c] = <unsigned char>acc
+            dst[y,x,3] = 0
+
+def resample(src, int width, int height, str filter="area", int threads=0):
+    """
+    Resample a bitmap, laid out like `Fraktal.image_data_rgba`, to
+    `width`×`height`. Returns a new array.
+
+    The work is split into bands of rows, which run in `threads` threads
+    (default: one per CPU) without holding the GIL.
+    """
+    cdef const unsigned char[:,:,::1] s = src
+    res = numpy.empty((height,width,4), numpy.uint8)
+    cdef unsigned char[:,:,::1] d = res
+    yi,yw = _resample_weights(s.shape[0], height, filter)
+    xi,xw = _resample_weights(s.shape[1], width, filter)
+    cdef const Py_ssize_t[:,::1] yiv = yi
+    cdef const float[:,::1] ywv = yw
+    cdef const Py_ssize_t[:,::1] xiv = xi
+    cdef const float[:,::1] xwv = xw
+
+    if threads < 1:
+        threads = os.cpu_count() or 1
+    threads = max(min(threads, height//16), 1)
+    bands = [(height*i//threads, height*(i+1)//threads) for i in range(threads)]
+
+    def band(r):
+        cdef float[:,::1] tmp = numpy.empty((s.shape[1],3), numpy.float32)
+        cdef Py_ssize_t r0=r[0], r1=r[1]
+        with nogil:
+            _resample_rows(s,d, yiv,ywv, xiv,xwv, tmp, r0,r1)
+
+    if threads == 1:
+        band(bands[0])
+    else:
+        with ThreadPoolExecutor(threads) as ex:
+            list(ex.map(band, bands))
+    return res
+
+##
+# Colouring.
+#
+# A pixel's value is its smooth iteration count, n + 1 - trans, put through
+# a transfer function and divided by the iteration divisor. It indexes a
+# palette table cyclically, interpolating between neighbouring entries.
+#
+# Slopes shade by the gradient of the smooth count along the light
+# direction. Distance estimation darkens pixels that are closer than `de`
+# pixels to the boundary. Unevaluated pixels are left alone.
+#
+# Like resampling, the rows are coloured in bands, in threads, without the
+# GIL. The bitmap is written directly.
+##
+
+colour_transfers = ("linear", "sqrt", "log")
+
+cdef struct _ColourParams:
+    double max_iter
+    double div
+    double offset
+    int smooth
+    int transfer
+    double slope_x
+    double slope_y
+    double slope_power
+    double slope_ratio
+    double de
+    double interior[3]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline double _smooth_iter(const unsigned int[:,::1] lsb, const unsigned int[:,::1] msb, bint has_msb,
+        const float[:,::1] trans, Py_ssize_t x, Py_ssize_t y, bint smooth) noexcept nogil:
+    cdef double n = lsb[x,y]
+    cdef float t
+    if has_msb:
+        n += msb[x,y] * 4294967296.
+    if smooth:
+        t = trans[x,y]
+        # glitched pixels have negative trans
+        if t < 0:
+            t = 0
+        elif t > 1:
+            t = 1
+        n += 1 - t
+    return n
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline bint _unevaluated(const unsigned int[:,::1] lsb, const unsigned int[:,::1] msb, bint has_msb,
+        Py_ssize_t x, Py_ssize_t y) noexcept nogil:
+    # the MSB half of a 64-bit UNEVALUATED is its sign extension
+    return lsb[x,y] == 0x80000000U and (not has_msb or msb[x,y] == 0xFFFFFFFFU)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void _colour_rows(const unsigned int[:,::1] lsb, const unsigned int[:,::1] msb, bint has_msb,
+        const float[:,::1] trans, const float[:,::1] dex, const float[:,::1] dey, bint has_de,
+        const float[:,::1] table, unsigned char[:,:,::1] dst, _ColourParams *p,
+        Py_ssize_t r0, Py_ssize_t r1) noexcept nogil:
+    cdef Py_ssize_t nX = lsb.shape[0], nY = lsb.shape[1], nT = table.shape[0]
+    cdef Py_ssize_t x,y,row,i,j,c,xa,xb,ya,yb
+    cdef bint slopes = p.slope_power != 0 and p.slope_ratio != 0
+    cdef double v,pos,f,d,gx,gy
+    cdef double rgb[3]
+
+    for y in range(r0, r1):
+        # the bitmap is bottom-up
+        row = nY-1-y
+        for x in range(nX):
+            if _unevaluated(lsb,msb,has_msb, x,y):
+                continue
+            v = _smooth_iter(lsb,msb,has_msb, trans, x,y, False)
+            if v >= p.max_iter:
+                for c in range(3):
+                    rgb[c] = p.interior[c]
+            else:
+                v = _smooth_iter(lsb,msb,has_msb, trans, x,y, p.smooth)
+                if p.transfer == 1:
+                    pos = sqrt(v)
+                elif p.transfer == 2:
+                    pos = log(v+1)
+                else:
+                    pos = v
+                pos = fmod(pos/p.div + p.offset, <double>nT)
+                if pos < 0:
+                    pos += nT
+                i = <Py_ssize_t>pos
+                if i >= nT:
+                    i = nT-1
+                f = pos-i
+                j = i+1 if i+1 < nT else 0
+                for c in range(3):
+                    rgb[c] = table[i,c]*(1-f) + table[j,c]*f
+
+                if slopes:
+                    # unevaluated neighbours don't count, like the edges
+                    xa = x+1 if x+1 < nX and not _unevaluated(lsb,msb,has_msb, x+1,y) else x
+                    xb = x-1 if x > 0 and not _unevaluated(lsb,msb,has_msb, x-1,y) else x
+                    ya = y+1 if y+1 < nY and not _unevaluated(lsb,msb,has_msb, x,y+1) else y
+                    yb = y-1 if y > 0 and not _unevaluated(lsb,msb,has_msb, x,y-1) else y
+                    gx = (_smooth_iter(lsb,msb,has_msb, trans, xa, y, p.smooth)
+                        - _smooth_iter(lsb,msb,has_msb, trans, xb, y, p.smooth))
+                    gy = (_smooth_iter(lsb,msb,has_msb, trans, x, ya, p.smooth)
+                        - _smooth_iter(lsb,msb,has_msb, trans, x, yb, p.smooth))
+                    # lit where the count falls towards the light
+                    d = -(gx*p.slope_x + gy*p.slope_y) * p.slope_power
+                    d = atan(d) * 2 / M_PI * p.slope_ratio
+                    if d > 0:
+                        for c in range(3):
+                            rgb[c] += (255-rgb[c])*d
+                    else:
+                        for c in range(3):
+                            rgb[c] *= 1+d
+
+                if has_de and p.de > 0:
+                    d = sqrt(dex[x,y]*dex[x,y] + dey[x,y]*dey[x,y]) / p.de
+                    if d < 1:
+                        d = sqrt(d)
+                        for c in range(3):
+                            rgb[c] *= d
+
+            for c in range(3):
+                if rgb[c] < 0:
+                    rgb[c] = 0
+                elif rgb[c] > 255:
+                    rgb[c] = 255
+            # BGRX
+            dst[row,x,0] = <unsigned char>(rgb[2]+.5)
+            dst[row,x,1] = <unsigned char>(rgb[1]+.5)
+            dst[row,x,2] = <unsigned char>(rgb[0]+.5)
+            dst[row,x,3] = 0
+
+def colour(Fraktal fr, table, double div=1, double offset=0, bint smooth=True, str transfer="linear",
+        double slope_angle=45, double slope_power=0, double slope_ratio=0.5,
+        double de=0, interior=(0,0,0), int threads=0):
+    """
+    Colour `fr`'s bitmap from its iteration data. See `kf2.colour`.
+
+    table: (n,3) float32 palette, RGB 0…255.
+    threads: see `resample`.
+    """
+    cdef _ColourParams p
+    cdef const float[:,::1] tv = numpy.ascontiguousarray(table, numpy.float32)
+    fr._check_bitmap()
+    bufs = fr.buffers
+    dst_a = fr.image_data_rgba
+    cdef unsigned char[:,:,::1] dst = dst_a
+    lsb_a = numpy.asarray(bufs.iter_lsb)
+    cdef const unsigned int[:,::1] lsb = lsb_a
+    cdef const float[:,::1] trans = numpy.asarray(bufs.trans)
+    cdef const unsigned int[:,::1] msb = lsb
+    cdef bint has_msb = False
+    cdef const float[:,::1] dex = trans
+    cdef const float[:,::1] dey = trans
+    cdef bint has_de = False
+
+    if lsb.shape[1] != dst.shape[0] or lsb.shape[0] != dst.shape[1]:
+        raise RuntimeError("bitmap size %dx%d doesn't match the image %dx%d"
+                % (dst.shape[1],dst.shape[0], lsb.shape[0],lsb.shape[1]))
+    if tv.shape[0] == 0 or tv.shape[1] != 3:
+        raise ValueError("the palette table must be (n,3), not %r" % (tv.shape,))
+    if transfer not in colour_transfers:
+        raise ValueError(f"unknown transfer {transfer !r}, use one of {colour_transfers}")
+    interior = tuple(interior)
+    if len(interior) != 3:
+        raise ValueError("the interior colour must be (r,g,b), not %r" % (interior,))
+    try:
+        msb = numpy.asarray(bufs.iter_msb)
+        has_msb = True
+    except RuntimeError:
+        pass
+    if de > 0:
+        try:
+            dex = numpy.asarray(bufs.dex)
+            dey = numpy.asarray(bufs.dey)
+        except RuntimeError:
+            raise RuntimeError("distance colouring needs derivatives") from None
+        has_de = True
+
+    p.max_iter = fr.iterations
+    p.div = div if div > 0 else 1
+    p.offset = offset
+    p.smooth = smooth
+    p.transfer = colour_transfers.index(transfer)
+    p.slope_x = cos(slope_angle*M_PI/180)
+    # image rows run downwards
+    p.slope_y = -sin(slope_angle*M_PI/180)
+    p.slope_power = slope_power
+    p.slope_ratio = slope_ratio
+    p.de = de
+    for i,v in enumerate(interior):
+        p.interior[i] = v
+
+    height = lsb.shape[1]
+    if threads < 1:
+        threads = os.cpu_count() or 1
+    threads = max(min(threads, height//16), 1)
+    bands = [(height*i//threads, height*(i+1)//threads) for i in range(threads)]
+
+    def band(r):
+        cdef Py_ssize_t r0=r[0], r1=r[1]
+        with nogil:
+            _colour_rows(lsb,msb,has_msb, trans,dex,dey,has_de, tv, dst, &p, r0,r1)
+
+    if threads == 1:
+        band(bands[0])
+    else:
+        with ThreadPoolExecutor(threads) as ex:
+            list(ex.map(band, bands))
+
 __version__ = str(version,"utf-8")
 
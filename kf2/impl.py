@@ -2,18 +2,44 @@ from .core import Fraktal as _Fractal
 from threading import Lock
 from contextlib import asynccontextmanager
 from functools import partial
+import os
 import sys
+import math
+import time
 from dataclasses import dataclass
 from typing import Callable
 from inspect import iscoroutine
 
 from PIL import Image
+import numpy
 
 import trio
 
+from .stats import RenderStats, LatencyHistogram
+from .refcache import ReferenceCache, ReferenceKey, references
+from .cache import RenderCache
+from .kfb import KFB
+from .colour import Colouring
+from .trace import tracer
+
 class RenderStoppedError(RuntimeError):
     pass
 
+def _palette_name(fn, name, suffix):
+    if "{palette}" in fn:
+        return fn.replace("{palette}", name)
+    if not suffix:
+        return fn
+    base,ext = os.path.splitext(fn)
+    return f"{base}-{name}{ext}"
+
+def _fsync(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 ##
 # The Fractal class implements a work queue, to sync between a render task,
 # the GUI, and any changes the latter wants to apply to the former.
@@ -33,6 +59,12 @@ class RenderStoppedError(RuntimeError):
 #
 # A Render process is started.
 #
+# Before they're applied, queued workers are coalesced: a run of zooms
+# becomes a single zoom, consecutive size changes collapse to the last one.
+# Workers that don't touch the fractal (`passive`) don't interrupt such a
+# run. Superseded workers are not applied, but they're still triggered and
+# completed, with the status of the worker that replaced them.
+#
 # Last, every worker's `done` method is called, asynchronously, with a flag
 # stating whether the render completed (True), didn't happen (None) or was
 # cancelled by subsequent work (False). In the latter case
@@ -50,6 +82,29 @@ class _Apply:
     delay:float = 0.2
     # Max time to wait for new commands before we go ahead
 
+    _queued:float = None
+    # trio time of `do_work`
+
+    passive:bool = False
+    # Flag whether `apply` leaves the fractal alone, so that other
+    # workers may be merged across this one
+
+    def merge(self, other):
+        """
+        Return a single worker with the effect of applying `self`, then
+        `other`, or None if there's no such thing.
+        """
+        return None
+
+    def predict(self,kf):
+        """
+        Called when the worker is queued, to show what its result will
+        look like.
+
+        Must not modify the fractal.
+        """
+        pass
+
     def apply(self,kf):
         """
         Called to do actual work.
@@ -90,9 +145,13 @@ class ApplyWork(ApplyNow):
     def __repr__(self):
         return f"ApplyWork:{self._name}"
 
+    @property
+    def passive(self):
+        return self._worker is None
+
     def apply(self, kf):
         if self._worker is not None:
-            self._worker
+            return self._worker()
 
     def trigger(self,ok):
         if self._trigger is not None:
@@ -107,6 +166,7 @@ class ApplyWork(ApplyNow):
 class ApplyRendered(ApplyNow):
     """wait for render to finish"""
     ok = None
+    passive = True
 
     def __init__(self):
         self.evt = trio.Event()
@@ -119,6 +179,27 @@ class ApplyRendered(ApplyNow):
         await self.evt.wait()
 
 
+class ApplyView(_Apply):
+    """go to a view saved with `params_str`, e.g. for back/forward"""
+    breaks = True
+    renders = True
+
+    def __init__(self, params:str):
+        self.params = params
+
+    def __repr__(self):
+        return f"ApplyView:{len(self.params)}"
+
+    def merge(self, other):
+        if isinstance(other, ApplyView):
+            return other
+        return None
+
+    def apply(self, kf):
+        # not params_str: that ignores the location
+        kf.openString(self.params)
+        return True
+
 @dataclass
 class ApplySize(_Apply):
     """change the image size"""
@@ -133,10 +214,15 @@ class ApplySize(_Apply):
         kf.target_dimensions = (self.w,self.h,self.s)
         return True
 
+    def merge(self, other):
+        if isinstance(other, ApplySize):
+            return other
+        return None
+
 @dataclass
 class ApplyZoom(_Apply):
-    x: int
-    y: int
+    x: float
+    y: float
     size: float
     reuseCenter:bool = False
     centerView:bool = False
@@ -144,8 +230,33 @@ class ApplyZoom(_Apply):
     breaks=True
     renders=True
 
+    def merge(self, other):
+        """
+        Two zooms are one zoom: the second zoom's point, mapped back to
+        the first image, relative to the first zoom's point; the factors
+        multiply.
+        """
+        if not isinstance(other, ApplyZoom):
+            return None
+        if (self.reuseCenter,self.centerView) != (other.reuseCenter,other.centerView):
+            return None
+        if self._size is None or self._size != other._size:
+            return None
+        nx,ny = self._size
+        res = ApplyZoom(self.x + (other.x - nx/2)/self.size,
+                self.y + (other.y - ny/2)/self.size,
+                self.size*other.size, self.reuseCenter, self.centerView)
+        res._size = self._size
+        return res
+
+    _size = None
+
+    def predict(self,kf):
+        self._size = kf.render_size
+        kf.predict_zoom(self.x,self.y,self.size)
+
     def apply(self,kf):
-        kf.zoom(self.x,self.y,self.size)
+        kf.zoom(round(self.x),round(self.y),self.size)
         return True
          
 
@@ -158,6 +269,59 @@ class Fractal(_Fractal):
     q_render = None
     q_finish = None
 
+    render_stats:RenderStats = None
+    # statistics of the last render
+
+    stats_file:str = None
+    # if set, append the stats of each render to this file, as JSON lines
+
+    downscale_filter:str = "lanczos"
+    # filter for saving supersampled images at the target size
+
+    render_cache:RenderCache = None
+    # if set, re-rendering a view that's in this cache restores the
+    # buffers instead
+
+    progressive:tuple = ()
+    # scales of low-resolution preview passes that run before each render.
+    # E.g. (8,) first renders at 1/8th the size. Previews use the full
+    # iteration limit, so that they share the render's reference orbit:
+    # the first one computes it, the rest re-use it (see `ref_cache`).
+    # They're skipped when the render resumes a stopped one.
+
+    preview_image = None
+    # the latest preview, as a (copied) numpy array like image_data_rgba.
+    # Cleared when a render completes.
+
+    on_preview:Callable = None
+    # called (in the main thread) when there's a new preview
+
+    _full_size = None
+    # the real image size, during preview passes
+
+    _latency:dict = None
+    _render_started:float = None
+    _stop_requested:float = None
+
+    colouring:Colouring = None
+    # if set, `applyColors` uses this instead of the library's colouring
+
+    glitch_batch:int = 0
+    # if set, find up to this many glitch centers in one scan of the image,
+    # instead of asking the library for the "best" one before each pass
+
+    resume_stopped:bool = True
+    # if set, rendering the same view as a render that was stopped only
+    # calculates the pixels the stopped render didn't get to
+
+    _partial = None
+    # the view of the last stopped render
+
+    ref_cache:ReferenceCache = references
+    # tracks which reference orbit we hold, so it can be re-used.
+    # Set to None to always recompute.
+    _ref_key:ReferenceKey = None
+
     # four states:
     # - idle (r_done is None)
     # - rendering (r_working is set)
@@ -178,34 +342,143 @@ class Fractal(_Fractal):
         """
         if self.stop_render:
             return
-        self.log("info", f"Start render {name}")
+        self.log("info", "Start render %s", name)
+        stats = RenderStats()
+        stats.begin(self, name)
+        self.render_stats = stats
+
+        view = self._partial_key()
+        resume = self._partial == view
+        self._partial = None
+
         self.add_references = 0
-        if reset_old_glitch:
+        if resume:
+            # only calculate the pixels the stopped render didn't get to
+            stats.resumed = self.markUnevaluated()
+            self.log("info", "resuming a stopped render, %d pixels left", stats.resumed)
+            self.add_references = 1
+        elif reset_old_glitch:
             self.resetGlitches()
 
-        super().fixIterLimit()
-        super().renderFractal()
+        t = time.monotonic()
         super().fixIterLimit()
 
+        cache = self.ref_cache
+        key = ReferenceKey.of(self) if cache is not None else None
+        reuse = self.reuse_reference
+        recomputed = False
+        if key is not None and not reuse and cache.holds(self, key):
+            self.log("info", "re-using the reference orbit")
+            self.reuse_reference = True
+        elif resume:
+            # the stop hit a glitch pass, so we hold its orbit, not the
+            # primary one: compute a reference at the center again
+            self.addReference(self.nX//2, self.nY//2)
+            recomputed = True
+        try:
+            with tracer.span("pass", ref=1, reuse=self.reuse_reference):
+                super().renderFractal()
+        finally:
+            self.reuse_reference = reuse
+        if key is not None:
+            if self.stop_render:
+                # the orbit may be incomplete
+                cache.forget(self)
+            elif not recomputed and not reuse:
+                # with `reuse` forced by the caller, the orbit is still the
+                # one we held before, whatever its key
+                cache.note(self, key)
+
+        # only a render whose first pass completed can be resumed
+        primary_done = not self.stop_render
+        if primary_done:
+            super().fixIterLimit()
+        stats.pass_done(self, 1, t)
+
         if self.auto_solve_glitches and self.auto_glitch:
+            centers = []
             for r in range(2,self.max_references):
                 if self.stop_render:
                     break
                 self.auto_glitch = r
-                n = self.findCenterOfGlitch()
+                with tracer.span("glitch scan", ref=r):
+                    n = self._next_glitch(centers)
                 if n is None:
                     self.log("info", "No more glitches")
                     break
                 x,y,n = n
-                self.log("info", f"reference {r} at ({x},{y}) size {n-1}")
-                self.addReference(x,y)
-                super().renderFractal()
-                super().fixIterLimit()
+                self.log("info", "reference %d at (%d,%d) size %d", r,x,y,n)
+                t = time.monotonic()
+                with tracer.span("pass", ref=r, x=x, y=y, size=n):
+                    self.addReference(x,y)
+                    super().renderFractal()
+                    if not self.stop_render:
+                        super().fixIterLimit()
+                stats.pass_done(self, r, t, x=x, y=y, glitch_size=n)
         else:
             self.log("info", "No glitch fixing")
-        if color:
-            self.applyColors()
-        self.log("info", f"Stop render {name}" if self.stop_render else f"End render {name}")
+        if color and not self.stop_render:
+            t = time.monotonic()
+            with tracer.span("colour"):
+                self.applyColors()
+            stats.colouring = time.monotonic()-t
+        if self.stop_render and self.resume_stopped and primary_done:
+            self._partial = view
+        stats.end(self, self.stop_render)
+        self.log("info", "%s render %s", "Stop" if self.stop_render else "End", name)
+
+    def applyColors(self):
+        """Colour the image, with `colouring` if it's set"""
+        if self.colouring is None:
+            super().applyColors()
+        else:
+            self.colouring.apply(self)
+
+    def _next_glitch(self, centers:list):
+        """
+        Find the next glitch to correct. Returns (x,y,size), or None.
+
+        With `glitch_batch` set, `centers` holds the remaining results of
+        the last scan. They're re-checked, as a reference placed for one
+        glitch often fixes others too.
+        """
+        if not self.glitch_batch:
+            n = self.findCenterOfGlitch()
+            if n is None:
+                return None
+            x,y,n = n
+            return x,y,n-1
+
+        trans = numpy.asarray(self.buffers.trans)
+        while centers:
+            x,y,n = centers.pop(0)
+            if trans[x,y] < 0:
+                return x,y,n
+
+        centers[:] = self.findGlitchCenters(self.glitch_batch)
+        if not centers:
+            return None
+        return centers.pop(0)
+
+    def _partial_key(self):
+        return (self.params_str, self.settings_str, self.getImageSize(), self.buffer_generation)
+
+    def request_stop(self):
+        """
+        Tell the current render to stop.
+
+        The time until it actually does is recorded, see `latency`.
+        """
+        if self._stop_requested is None:
+            self._stop_requested = trio.current_time()
+        self.stop_render = True
+
+    def addReference(self, x:int, y:int, **kw):
+        """Sets the reference r+i values to these coordinates"""
+        if self.ref_cache is not None:
+            # this replaces the primary orbit
+            self.ref_cache.forget(self)
+        return super().addReference(x, y, **kw)
 
     def _render(self, **kw):
         try:
@@ -231,31 +504,34 @@ class Fractal(_Fractal):
         i=self.i; self.i+=1
         name = kw.setdefault("name","render_lock")
 
-        self.log("debug",f"lock {i} {name}")
+        self.log("debug","lock %d %s", i,name)
 
         if kill is None and self.r_done is not None:
             raise RuntimeError(f"already locked, {name}")
         if kill:
-            self.stop_render = True
+            self.request_stop()
         evt2 = trio.Event()
         evt,self.r_done = self.r_done,evt2
 
         if evt is not None:
-            await evt.wait()
-            self.log("debug",f"locked {i} {name}")
+            with tracer.span("lock wait", lock=name):
+                await evt.wait()
+            self.log("debug","locked %d %s", i,name)
         else:
-            self.log("debug",f"locked {i} {name} NOWAIT")
+            self.log("debug","locked %d %s NOWAIT", i,name)
         try:
 
             self.stop_render = False
-            yield self
+            self._stop_requested = None
+            with tracer.span("locked", lock=name):
+                yield self
 
             if run:
                 kw["name"] = name+" RUN"
                 kw["kill"] = True
                 self.n.start_soon(partial(self.render, **kw))
         finally:
-            self.log("debug",f"done {i} {name}")
+            self.log("debug","done %d %s", i,name)
             self.stop_render = False
             if self.r_done is evt2:
                 self.r_done = None
@@ -279,6 +555,55 @@ class Fractal(_Fractal):
             raise RuntimeError("don't do this while rendering")
         # TODO check whether the correct thread has the lock
 
+### Long-running library calls
+    # These run in a thread, under the render lock. The library releases
+    # the GIL, so the event loop (and thus the GUI) keeps going.
+
+    async def _locked_thread(self, fn, *a, **kw):
+        async with self.render_lock(name=fn.__name__):
+            return await trio.to_thread.run_sync(partial(fn, *a, **kw))
+
+    async def async_applyColors(self):
+        await self._locked_thread(self.applyColors)
+
+    async def async_openFile(self, filename:str, noLocation:bool=False):
+        await self._locked_thread(self.openFile, filename, noLocation)
+
+    async def async_openString(self, text:str, noLocation:bool=False):
+        await self._locked_thread(self.openString, text, noLocation)
+
+    async def async_openMapB(self, filename:str, reuseCenter:bool=False, zoomSize:float=1):
+        await self._locked_thread(self.openMapB, filename, reuseCenter, zoomSize)
+
+    async def async_openMapEXR(self, filename:str):
+        await self._locked_thread(self.openMapEXR, filename)
+
+    async def async_openSettings(self, filename:str):
+        await self._locked_thread(self.openSettings, filename)
+
+    async def async_saveSettings(self, filename:str, overwrite:bool=True):
+        await self._locked_thread(self.saveSettings, filename, overwrite)
+
+    async def async_saveKFR(self, filename:str):
+        await self._locked_thread(self.saveKFR, filename)
+
+    async def async_saveMap(self, filename:str):
+        await self._locked_thread(self.saveMap, filename)
+
+    async def async_saveEXR(self, filename:str, **kw):
+        await self._locked_thread(self.saveEXR, filename, **kw)
+
+    async def async_setImageSize(self, nx:int, ny:int):
+        await self._locked_thread(self.setImageSize, nx, ny)
+
+    async def async_get_settings(self) -> str:
+        return await self._locked_thread(lambda: self.settings_str)
+
+    async def async_set_settings(self, data:str):
+        def set_():
+            self.settings_str = data
+        await self._locked_thread(set_)
+
     _waitdone = None
     async def wait_render_done(self):
         """wait until a successful render"""
@@ -312,21 +637,62 @@ class Fractal(_Fractal):
         """
         kw.setdefault("name","render")
         kw.setdefault("kill",None)
-        self.log("debug",f"render locking {kw}")
+        self.log("debug","render locking %r", kw)
         async with self.render_lock(run=False, **kw):
             await self.render_locked(**kw)
 
-    async def render_locked(self, stop_ok=False, **kw):
+    async def render_locked(self, stop_ok=False, progressive=None, **kw):
         """
         See `render`.
 
         The render lock must already have been taken.
+
+        Params:
+            progressive: preview passes to run first, see `progressive`.
+                         Default: the attribute.
         """
         self.log("debug","render locked")
         if self.r_working is not None:
             raise RuntimeError(f"Locked for render but WORKING is on")
+        self._render_started = trio.current_time()
+
+        cache = self.render_cache
+        if cache is not None:
+            key = cache.key(self)
+            if cache.restore(self, key):
+                self.preview_image = None
+                if kw.get("color", True):
+                    await trio.to_thread.run_sync(self.applyColors)
+                return
+
+        if progressive is None:
+            progressive = self.progressive
+        if progressive and self._partial != self._partial_key():
+            # not when resuming: that would replace the buffers
+            await self._render_previews(progressive, **kw)
+
+        if not self.stop_render:
+            await self._render_thread(**kw)
+
+            if not self.stop_render:
+                self.preview_image = None
+                if cache is not None:
+                    # also file it under the post-render key: auto iterations
+                    # may have changed the parameters
+                    await trio.to_thread.run_sync(lambda: cache.store(self, key, cache.key(self)))
+
+            if self.stats_file is not None and self.render_stats is not None:
+                self.render_stats.append_to(self.stats_file)
+
+        if self.stop_render and not stop_ok:
+            raise RenderStoppedError()
 
+    async def _render_thread(self, **kw):
+        """
+        Run `_render` in a thread.
+        """
         self.r_working = trio.Event()
+        self.render_stats = None
         try:
             await trio.to_thread.run_sync(partial(self._render, **kw), cancellable=True)
         except BaseException as exc:
@@ -336,9 +702,126 @@ class Fractal(_Fractal):
             with trio.CancelScope(shield=True):
                 await self.r_working.wait()
             self.r_working = None
+            if self.stop_render and self._stop_requested is not None:
+                t = trio.current_time() - self._stop_requested
+                self._stop_requested = None
+                self.latency["stop"].add(t)
+                if self.render_stats is not None:
+                    self.render_stats.stop_latency = t
+
+    async def _render_previews(self, passes, name="render", **kw):
+        """
+        Run fast low-resolution renders, without glitch correction, and
+        publish each result as `preview_image`.
 
-        if self.stop_render and not stop_ok:
-            raise RenderStoppedError()
+        Stops early if the render is stopped.
+        """
+        size = self.getImageSize()
+        self._full_size = size
+        glitches = self.auto_solve_glitches
+        auto_iter = self.auto_iterations
+        kw["color"] = True
+        try:
+            self.auto_solve_glitches = False
+            self.auto_iterations = False
+            for i,scale in enumerate(passes):
+                self.setImageSize(max(size[0]//scale,1), max(size[1]//scale,1))
+                await self._render_thread(name=f"{name} preview {i}", **kw)
+                if self.stop_render:
+                    break
+                self.preview_image = numpy.array(self.image_data_rgba)
+                if self.on_preview is not None:
+                    self.on_preview()
+        finally:
+            self.auto_solve_glitches = glitches
+            self.auto_iterations = auto_iter
+            self.setImageSize(*size)
+            self._full_size = None
+
+    @property
+    def latency(self):
+        """
+        Latency histograms of the work queue, see `LatencyHistogram`:
+
+        queue: from `do_work` until the worker is handed to the work task.
+        lock: waiting for the render lock, before applying a batch.
+        render: from `do_work` of the oldest worker in a batch until its
+                render starts.
+        stop: from `request_stop` until the render has stopped.
+        """
+        if self._latency is None:
+            self._latency = dict(queue=LatencyHistogram(), lock=LatencyHistogram(),
+                    render=LatencyHistogram(), stop=LatencyHistogram())
+        return self._latency
+
+    @property
+    def render_size(self):
+        """
+        The size of the image being rendered. Unlike `getImageSize`, this
+        ignores preview passes.
+        """
+        return self._full_size or self.getImageSize()
+
+    def display_image(self):
+        """
+        What to show while a render runs, as an array like
+        `image_data_rgba`, or None to show the bitmap.
+
+        During preview passes, that's the latest preview (or predicted
+        zoom). Once the full-size pass runs, the pixels it has calculated
+        are laid over the scaled-up preview, so that real pixels replace
+        it as they arrive.
+        """
+        prev = self.preview_image
+        if prev is None or self._full_size is not None or not self.is_rendering:
+            return prev
+        try:
+            img = self.image_data_rgba
+            # buffers are [x,y], the bitmap is bottom-up
+            done = numpy.asarray(self.buffers.iter_lsb).T[::-1] != 0x80000000
+        except RuntimeError:  # no bitmap or buffers (yet)
+            return prev
+        h,w,_ = img.shape
+        if done.shape != (h,w):
+            return prev
+        ph,pw,_ = prev.shape
+        res = prev[numpy.ix_(numpy.arange(h)*ph//h, numpy.arange(w)*pw//w)]
+        res[done] = img[done]
+        return res
+
+    def predict_zoom(self, x, y, factor):
+        """
+        Publish a predicted image for zooming by `factor` around pixel
+        (x,y) as `preview_image`: the picture that's currently shown,
+        scaled so that (x,y) becomes the center.
+
+        The next preview or render result replaces it.
+        """
+        img = self.preview_image
+        if img is None:
+            try:
+                img = self.image_data_rgba
+            except RuntimeError:  # no bitmap yet
+                return
+        h,w,_ = img.shape
+        if not w or not h:
+            return
+        nx,ny = self.render_size
+        x *= w/nx
+        y *= h/ny
+
+        # source pixel for each target pixel, top-down
+        sx = numpy.floor(x + (numpy.arange(w)+.5 - w/2)/factor).astype(numpy.intp)
+        sy = numpy.floor(y + (numpy.arange(h)+.5 - h/2)/factor).astype(numpy.intp)
+        rx = numpy.nonzero((sx >= 0) & (sx < w))[0]
+        ry = numpy.nonzero((sy >= 0) & (sy < h))[0]
+
+        res = numpy.zeros_like(img)
+        # the bitmap is stored bottom-up
+        res[::-1][numpy.ix_(ry,rx)] = img[::-1][numpy.ix_(sy[ry],sx[rx])]
+        self.preview_image = res
+        if self.on_preview is not None:
+            self.on_preview()
 
     def do_work(self, task):
         """Enqueue this work item"""
@@ -346,13 +829,20 @@ class Fractal(_Fractal):
         if not self.q_work:
             self.q_work,rq = trio.open_memory_channel(1000)
             self.n.start_soon(self._mgr,"work",rq,self._work_task)
+        tracer.instant("queue", work=task)
+        task._queued = trio.current_time()
         self.q_work.send_nowait(task) 
+        task.predict(self)
         if task.breaks:
-            self.stop_render = True
+            self.request_stop()
 
 ### Task management details
 
     async def _work_task(self, work, rq):
+        now = trio.current_time()
+        for w in work:
+            self.latency["queue"].add(now - w._queued)
+
         breaks = False
         for w in work:
             self.log("debug","WorkB %r %s", w,w.breaks)
@@ -362,17 +852,15 @@ class Fractal(_Fractal):
 
         self.log("debug","WorkC %s",breaks)
         async with self.render_lock(kill=breaks, run=False, name="mgr"):
-            for w in work:
-                self.log("debug","WorkD %r", w)
-                w.renders = w.apply(self) or w.renders
-            while True:
-                try:
-                    with trio.fail_after(0.01):
-                        w = await rq.receive()
+            self.latency["lock"].add(trio.current_time() - now)
+            # pick up whatever arrived while we waited for the lock
+            self._drain(rq, work)
+            for w,parts in self._coalesce(work):
+                self.log("debug","WorkD %r %d", w,len(parts))
+                with tracer.span("apply", work=w, merged=len(parts)):
                     w.renders = w.apply(self) or w.renders
-                    work.append(w)
-                except trio.TooSlowError:
-                    break
+                for p in parts:
+                    p.renders = w.renders
 
         if not self.q_render:
             self.log("debug","WorkE")
@@ -383,18 +871,47 @@ class Fractal(_Fractal):
             await self.q_render.send(w) 
         self.log("debug","WorkG")
 
+    @staticmethod
+    def _coalesce(work):
+        """
+        Merge these workers, as far as possible.
+
+        Returns a list of (worker, originals) tuples.
+        """
+        res = []
+        for w in work:
+            if not w.passive:
+                for i in range(len(res)-1, -1, -1):
+                    m = res[i][0].merge(w)
+                    if m is not None:
+                        res[i] = (m, res[i][1]+[w])
+                        break
+                    if not res[i][0].passive:
+                        break
+                else:
+                    m = None
+                if m is not None:
+                    continue
+            res.append((w,[w]))
+        return res
+
     async def _render_task(self, work, rq):
         render = False
         for w in work:
             self.log("debug","RenderB %r %s", w,w.renders)
             render |= w.renders
         if render:
+            t0 = min(w._queued for w in work if w._queued is not None)
+            self._render_started = None
             try:
                 await self.render(stop_ok=False)
             except RenderStoppedError:
                 done = False
             else:
                 done = True
+            finally:
+                if self._render_started is not None:
+                    self.latency["render"].add(self._render_started - t0)
         else:
             done = None
 
@@ -417,72 +934,306 @@ class Fractal(_Fractal):
                 self.log("debug","WorkF %r %s", w,done)
                 await w.done(done)
 
-    async def _mgr(self, name, queue, worker, init_run=False):
+    def _drain(self, queue, work):
+        """
+        Move all queued workers to `work`, without waiting.
+
+        Returns the smallest delay of the moved workers.
+        """
+        delay = math.inf
         while True:
-            work = []
-            self.log("debug", f"mgr {name} A")
             try:
-                delay = 99999
-                while True:
-                    with trio.fail_after(delay):
-                        w = await queue.receive()
-                        work.append(w)
-                        self.log("debug", "mgr %s B %r %s", name,w,w.delay)
-                        delay = min(w.delay,delay)
-            except trio.TooSlowError:
-                pass
-
-            self.log("debug", f"mgr {name} C {len(work)}")
-            await worker(work,queue)
+                w = queue.receive_nowait()
+            except trio.WouldBlock:
+                return delay
+            work.append(w)
+            self.log("debug", "mgr B %r %s", w,w.delay)
+            delay = min(w.delay,delay)
+
+    async def _mgr(self, name, queue, worker, init_run=False):
+        """
+        Collect batches of workers and feed them to `worker`.
+
+        A batch starts with the next worker to arrive and is complete when
+        no new worker has arrived for the smallest `delay` in it.
+        """
+        while True:
+            self.log("debug", "mgr %s A", name)
+            w = await queue.receive()
+            work = [w]
+            delay = min(w.delay, self._drain(queue, work))
+            while delay > 0:
+                deadline = trio.current_time() + delay
+                w = None
+                with trio.move_on_at(deadline):
+                    w = await queue.receive()
+                if w is None:
+                    break
+                work.append(w)
+                delay = min(w.delay, delay, self._drain(queue, work))
+
+            self.log("debug", "mgr %s C %d", name,len(work))
+            with tracer.span(name, batch=len(work)):
+                await worker(work,queue)
             init_run = False
 
 ### Saving pretty pictures
 
-    def save_frame(self, frame:int, only_kfr:bool, quality:int = 100,
+    async def save_frame(self, frame:int, only_kfr:bool, **save_args) -> dict:
+        """
+        Colour the image and save it in all requested formats.
+
+        The files are written concurrently, in worker threads. Returns when
+        all of them are on disk, with a dict of the seconds each format
+        took.
+
+        Don't render while this runs.
+        """
+        live, jobs = await trio.to_thread.run_sync(partial(self._snapshot_frame, frame, only_kfr, **save_args))
+        return await self._save_jobs(live+jobs)
+
+    async def _save_jobs(self, jobs, limiter=None) -> dict:
+        """
+        Run these (format,job) tuples in parallel threads.
+
+        Returns a dict of the seconds each format took.
+        """
+        times = {}
+        def traced(name, job):
+            with tracer.span("save", format=name):
+                job()
+
+        async def run(name, job):
+            t = time.monotonic()
+            await trio.to_thread.run_sync(traced, name, job, limiter=limiter)
+            times[name] = time.monotonic()-t
+
+        async with trio.open_nursery() as n:
+            for name,job in jobs:
+                n.start_soon(run, name, job)
+        if times and self.is_logging("info"):
+            self.log("info", "saved: %s", " ".join(f"{k}={v:.3f}s" for k,v in times.items()))
+        return times
+
+    def _snapshot_frame(self, frame:int, only_kfr:bool, quality:int = 100,
             save_exr=None, save_tif=None, save_png=None, save_jpg=None, save_kfr=None, save_map=None):
+        """
+        Colour the image and take a snapshot of it.
+
+        Returns two lists of (format,job) tuples. The jobs in the first
+        one read the live buffers, so they must finish before the next
+        render starts. The others write from the snapshot; they may run
+        concurrently with the next render.
+
+        Every job syncs its file to disk.
+        """
 
         def fixname(fn):
             if '%' in fn:
                 fn = fn % (frame,)
             return fn
+        live = []
+        jobs = []
         x,y,s = self.target_dimensions
         if not only_kfr:
             self.log("info","colouring final image")
             self.inhibit_colouring = False
-            self.applyColors()
-            img = self.pilImage # .resize((x,y), Image.LANCZOS)
+            if save_exr and self.colouring is None:
+                # colour at half precision right away, so that saveEXR
+                # doesn't need a second pass
+                self.half_colour = True
+            with tracer.span("colour", frame=frame):
+                self.applyColors()
+            if save_tif or save_png or save_jpg:
+                if s > 1 and self.getImageSize() == (x*s,y*s):
+                    # supersampled
+                    img = self.downscale(x,y, self.downscale_filter)
+                    img = Image.frombuffer("RGB", (x,y), img, "raw", "BGRX", 0, -1)
+                else:
+                    img = self.pilImage
+
+        def writer(name, fn, save):
+            fn = fixname(fn)
+            def job():
+                self.log("info", "saving %s %r", name,fn)
+                save(fn)
+                _fsync(fn)
+            return name, job
+
         if save_exr:
-            self.log("info", f"saving EXR {save_exr !r}")
-            self.saveEXR(fixname(save_exr))
+            # the library's half-float colours would not be ours
+            live.append(writer("EXR", save_exr, partial(self.saveEXR, half=self.colouring is None)))
+        if save_kfr:
+            live.append(writer("KFR", save_kfr, self.saveKFR))
+        if save_map:
+            live.append(writer("KFB", save_map, self.saveMap))
+
+        def saver(name, fn, **kw):
+            fn = fixname(fn)
+            def save():
+                self.log("info", "saving %s %r", name,fn)
+                with open(fn, "wb") as f:
+                    img.save(f, **kw)
+                    f.flush()
+                    os.fsync(f.fileno())
+            return name, save
+
         if save_tif:
-            self.log("info", f"saving TIFF {save_tif !r}")
-            img.save(fixname(save_tif),format="tiff",compression="tiff_lzw")
+            jobs.append(saver("TIFF", save_tif, format="tiff",compression="tiff_lzw"))
         if save_png:
-            self.log("info", f"saving PNG {save_png !r}")
-            img.save(fixname(save_png),format="png")
+            jobs.append(saver("PNG", save_png, format="png"))
         if save_jpg:
-            self.log("info", f"saving JPG {save_jpg !r}")
-            img.save(fixname(save_jpg),format="jpeg",quality=quality,optimize=True)
-        if save_kfr:
-            self.log("info", f"saving KFR {save_kfr !r}")
-            self.saveKFR(fixname(save_kfr))
-        if save_map:
-            self.log("info", f"saving KFB {save_map !r}")
-            self.saveKFR(fixname(save_map))
+            jobs.append(saver("JPG", save_jpg, format="jpeg",quality=quality,optimize=True))
+        return live, jobs
 
-    async def render_frame(self, frame:int, only_kfr:bool, **save_args):
+    async def save_palettes(self, frame:int, palettes, encoders:int = 2, **save_args) -> dict:
+        """
+        Re-colour the current render with each of these palette files, and
+        save it.
+
+        File names may contain "{palette}", which is replaced with the
+        palette file's name, without the extension. Otherwise, if there's
+        more than one palette, that name is appended to the file name.
+
+        A palette's images are encoded while the next one is coloured.
+        Returns a dict: palette => per-format times, see `save_frame`.
+        """
+        suffix = len(palettes) > 1
+        limiter = trio.CapacityLimiter(encoders)
+        res = {}
+
+        async def encode(pal, jobs):
+            res[pal].update(await self._save_jobs(jobs, limiter=limiter))
+
+        async with trio.open_nursery() as n:
+            for pal in palettes:
+                name = os.path.splitext(os.path.basename(pal))[0]
+                args = {k:(_palette_name(v, name, suffix) if k.startswith("save_") and v else v)
+                        for k,v in save_args.items()}
+                self.log("info", "palette %r", pal)
+                def recolour():
+                    self.openFile(pal, noLocation=True)
+                    return self._snapshot_frame(frame, False, **args)
+                live, jobs = await trio.to_thread.run_sync(recolour)
+                # these read the bitmap, so finish them before re-colouring
+                res[pal] = await self._save_jobs(live)
+                n.start_soon(encode, pal, jobs)
+        return res
+
+    def save_kfb(self, path):
+        """
+        Write the current buffers to a KFB file, without the library.
+
+        Iteration counts are stored as 32-bit integers, like the library
+        does. The distance estimate, if any, is stored as its magnitude.
+        """
+        bufs = self.buffers
+        de = None
+        if self.derivatives:
+            de = numpy.hypot(numpy.asarray(bufs.dex), numpy.asarray(bufs.dey)).astype(numpy.float32)
+        KFB.write(path, bufs.iter_lsb, bufs.trans, iter_div=int(self.iter_div),
+                colors=self.key_colors, max_iter=self.iterations, de=de)
+
+    def load_kfb(self, kfb):
+        """
+        Load a KFB map, given as a path or a `KFB`, into the buffers.
+
+        The image is resized if necessary. A stored distance estimate is
+        loaded as its X component. Colour afterwards.
+        """
+        if not isinstance(kfb, KFB):
+            kfb = KFB(kfb)
+        if self.getImageSize() != (kfb.width, kfb.height):
+            self.setImageSize(kfb.width, kfb.height)
+        bufs = self.buffers
+        try:
+            lsb = numpy.asarray(bufs.iter_lsb)
+        except RuntimeError:
+            # no buffers yet: let the library read the file
+            self.openMapB(kfb.path)
+            return
+
+        lsb[...] = kfb.iterations.view(numpy.uint32)
+        try:
+            msb = numpy.asarray(bufs.iter_msb)
+        except RuntimeError:
+            pass
+        else:
+            # sign extension
+            msb[...] = numpy.where(kfb.iterations < 0, numpy.uint32(0xFFFFFFFF), numpy.uint32(0))
+        numpy.asarray(bufs.trans)[...] = kfb.trans
+        if kfb.de is not None and self.derivatives:
+            numpy.asarray(bufs.dex)[...] = kfb.de
+            numpy.asarray(bufs.dey)[...] = 0
+
+        self.iter_div = kfb.iter_div
+        if len(kfb.colors):
+            self.key_colors = kfb.colors.tolist()
+        if kfb.max_iter:
+            self.iterations = kfb.max_iter
+
+    async def _render_frame(self, frame:int, only_kfr:bool):
+        """
+        Move to frame #`frame` of a zoom-out sequence and render it.
+        """
         self.inhibit_colouring = True
         self.interactive = False
         if not only_kfr:
             self.log("info", "reference 1 at center")
         if frame > 0:
-            if self.jitter_seed:
-                self.jitter_seed += 1
-            if not only_kfr:
-                self.fixIterLimit()
-            self.setPosition(self.center_re, self.center_im, self. self.radius * self.zoom_size)
+            async with self.render_lock(name="frame"):
+                if self.jitter_seed:
+                    self.jitter_seed += 1
+                if not only_kfr:
+                    self.fixIterLimit()
+                self.setPosition(self.center_re, self.center_im, self.zoom_radius * self.zoom_size)
         if not only_kfr:
             await self.render()
-        self.save_frame(frame, only_kfr, **save_args)
 
+    async def render_frame(self, frame:int, only_kfr:bool, **save_args):
+        await self._render_frame(frame, only_kfr)
+        return await self.save_frame(frame, only_kfr, **save_args)
+
+    async def render_sequence(self, frames:int, only_kfr:bool, pipeline:int = 2,
+            encoders:int = 2, min_zoom:float = .001, **save_args):
+        """
+        Render a zoom-out sequence.
+
+        Image encoding of frame N runs in a thread pool while frame N+1
+        renders. EXR, KFR and KFB files are written (in parallel) before
+        the next render starts because they read the live buffers.
 
+        Params:
+            frames: max number of frames.
+            pipeline: max number of frame snapshots that may wait for
+                      encoding. Rendering blocks when this is reached.
+                      Zero encodes each frame before rendering the next.
+            encoders: number of encoder threads.
+            min_zoom: stop when zoomed out this far.
+        """
+        if pipeline < 1:
+            for frame in range(frames):
+                await self.render_frame(frame, only_kfr, **save_args)
+                if 2/self.zoom_radius < min_zoom:
+                    break
+            return
+
+        limiter = trio.CapacityLimiter(encoders)
+        slots = trio.Semaphore(pipeline)
+
+        async def encode(frame, jobs):
+            try:
+                await self._save_jobs(jobs, limiter=limiter)
+                self.log("debug", "frame %d encoded", frame)
+            finally:
+                slots.release()
+
+        async with trio.open_nursery() as n:
+            for frame in range(frames):
+                await slots.acquire()
+                await self._render_frame(frame, only_kfr)
+                live, jobs = await trio.to_thread.run_sync(partial(self._snapshot_frame, frame, only_kfr, **save_args))
+                await self._save_jobs(live)
+                n.start_soon(encode, frame, jobs)
+                if 2/self.zoom_radius < min_zoom:
+                    break
@@ -0,0 +1,116 @@
+##
+# KFB map files, without the library.
+#
+# Layout (all little endian):
+#
+#   "KFB"
+#   int32 version (2), width, height
+#   int32 iterations[width][height]
+#   int32 iteration divisor
+#   int32 number of key colours
+#   uint8 key colours[n][3]  (r,g,b)
+#   int32 max iterations
+#   float32 trans[width][height]
+#   float32 DE[width][height]  (optional)
+#
+# Arrays are x-major, like the Fraktal's buffers. Reading a file maps it
+# into memory, so opening one only costs its header; pixel data is read
+# when it's accessed.
+##
+
+import os
+
+import numpy
+
+MAGIC = b"KFB"
+VERSION = 2
+
+_HEADER = numpy.dtype([("magic", "S3"), ("version", "<i4"), ("width", "<i4"), ("height", "<i4")])
+
+
+class KFB:
+    """
+    A memory-mapped KFB file.
+
+    iterations: int32 [x,y]
+    trans: float32 [x,y]
+    de: float32 [x,y], or None
+    iter_div, max_iter: ints
+    colors: (n,3) uint8 array of key colours
+
+    With mode "r+", changes to the arrays are written to the file.
+    """
+    def __init__(self, path, mode:str = "r"):
+        self.path = path
+        hdr = numpy.fromfile(path, _HEADER, count=1)
+        if not len(hdr) or hdr["magic"][0] != MAGIC:
+            raise ValueError(f"{path !r}: not a KFB file")
+        self.version = int(hdr["version"][0])
+        w = self.width = int(hdr["width"][0])
+        h = self.height = int(hdr["height"][0])
+        n = w*h
+
+        off = _HEADER.itemsize
+        self.iterations = numpy.memmap(path, "<i4", mode, offset=off, shape=(w,h))
+        off += 4*n
+        self.iter_div, n_colors = (int(x) for x in numpy.fromfile(path, "<i4", count=2, offset=off))
+        off += 8
+        self.colors = numpy.fromfile(path, numpy.uint8, count=3*n_colors, offset=off).reshape(-1,3)
+        off += 3*n_colors
+        self.max_iter = int(numpy.fromfile(path, "<i4", count=1, offset=off)[0])
+        off += 4
+        self.trans = numpy.memmap(path, "<f4", mode, offset=off, shape=(w,h))
+        off += 4*n
+        if os.path.getsize(path) >= off+4*n:
+            self.de = numpy.memmap(path, "<f4", mode, offset=off, shape=(w,h))
+        else:
+            self.de = None
+
+    def __repr__(self):
+        return f"<KFB {self.path !r} {self.width}×{self.height}>"
+
+    def close(self):
+        """Drop the mappings"""
+        self.iterations = self.trans = self.de = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *tb):
+        self.close()
+
+    @staticmethod
+    def write(path, iterations, trans, iter_div:int = 1, colors=(), max_iter:int = 0, de=None):
+        """
+        Write a KFB file.
+
+        The arrays are [x,y]. They are streamed to the file as they are,
+        if they already have the right type: 32-bit integers for
+        `iterations`, float32 for `trans` and `de`.
+        """
+        iterations = numpy.asarray(iterations)
+        w,h = iterations.shape
+        colors = numpy.asarray(colors, numpy.uint8).reshape(-1,3)
+        with open(path, "wb") as f:
+            hdr = numpy.zeros(1, _HEADER)
+            hdr[0] = (MAGIC, VERSION, w, h)
+            hdr.tofile(f)
+            _put(f, iterations, "<i4", (w,h))
+            numpy.array([iter_div, len(colors)], "<i4").tofile(f)
+            colors.tofile(f)
+            numpy.array([max_iter], "<i4").tofile(f)
+            _put(f, trans, "<f4", (w,h))
+            if de is not None:
+                _put(f, de, "<f4", (w,h))
+
+
+def _put(f, arr, dtype, shape):
+    arr = numpy.asarray(arr)
+    if arr.shape != shape:
+        raise ValueError(f"shape is {arr.shape}, not {shape}")
+    if arr.dtype.kind in "iu" and arr.dtype.itemsize == 4:
+        # same bits; unsigned LSB buffers wrap like the library's int cast
+        arr = arr.view(dtype)
+    else:
+        arr = arr.astype(dtype, copy=False)
+    numpy.ascontiguousarray(arr).tofile(f)
@@ -0,0 +1,68 @@
+##
+# Reference orbit re-use.
+#
+# The high-precision reference orbit is the expensive part of a deep
+# render. KF keeps the orbit of the last render around, but only re-uses it
+# when `reuse_reference` is set. This module tracks which orbit a Fractal
+# holds, keyed by everything the orbit depends on, so that `_render_` can
+# switch re-use on automatically when the next render (different size,
+# palette, or settings) starts from the same reference.
+#
+# A glitch-correction reference (`addReference`) replaces the orbit, so it
+# invalidates the key.
+#
+# The library offers no way to read back or install an orbit, so orbits
+# cannot be persisted to disk, or moved between instances.
+##
+
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ReferenceKey:
+    """Everything a reference orbit depends on"""
+    re: str
+    im: str
+    precision: int
+    iterations: int
+    fractal_type: int
+    power: int
+    derivatives: bool
+
+    @classmethod
+    def of(cls, kf):
+        """The key of the primary reference `kf` would compute now"""
+        re = kf.center_re
+        return cls(re=str(re), im=str(kf.center_im), precision=re.precision,
+                iterations=kf.iterations, fractal_type=kf.fractal_type,
+                power=kf.power, derivatives=bool(kf.derivatives))
+
+
+class ReferenceCache:
+    """
+    Tracks which reference orbit each Fractal instance holds, and counts
+    how often a render could re-use it.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def note(self, kf, key:ReferenceKey):
+        """`kf` has computed the orbit for `key`"""
+        kf._ref_key = key
+
+    def forget(self, kf):
+        """`kf` no longer holds its primary orbit"""
+        kf._ref_key = None
+
+    def holds(self, kf, key:ReferenceKey) -> bool:
+        """Check whether `kf` holds the orbit for `key`; counts hits"""
+        if getattr(kf, "_ref_key", None) == key:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+
+references = ReferenceCache()
+# the default tracker
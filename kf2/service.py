@@ -0,0 +1,359 @@
+##
+# A headless render service.
+#
+# A long-running process that keeps a pool of Fractal instances warm, so
+# that a job doesn't pay for startup, settings parsing and buffer
+# allocation. Jobs are queued by priority; each instance renders one job
+# at a time.
+#
+# Clients talk JSON lines over a unix socket. Requests:
+#
+#   {"action":"render", "id":"…", "priority":0, "settings":"…",
+#    "location":"…", "palette":"…", "width":640, "height":360,
+#    "outputs":{"png":"/path", "tif":…, "jpg":…, "exr":…, "kfr":…, "map":…},
+#    "quality":95}
+#   {"action":"cancel", "id":"…"}
+#   {"action":"status"}
+#
+# Only "location", "width" and "height" are required. Higher priorities
+# run first. The service answers with messages like
+#
+#   {"id":"…", "state":"queued"}
+#   {"id":"…", "state":"rendering"}
+#   {"id":"…", "state":"progress", "progress":{…}}
+#   {"id":"…", "state":"done", "stats":{…}}
+#
+# where the last one may also be "failed" (with an "error") or "cancelled".
+#
+# When a client closes its sending side, the connection stays open until
+# its jobs are finished. When it goes away entirely, its jobs are
+# cancelled.
+##
+
+import heapq
+import itertools
+import json
+import math
+import os
+import uuid
+
+import trio
+
+from .impl import Fractal, RenderStoppedError
+
+FINAL = frozenset(("done", "failed", "cancelled"))
+
+OUTPUTS = dict(exr="save_exr", tif="save_tif", png="save_png", jpg="save_jpg", kfr="save_kfr", map="save_map")
+
+
+class Job:
+    """A render job"""
+    kf = None
+    cancelled = False
+
+    def __init__(self, spec:dict, id:str = None, priority:int = 0):
+        for k in ("location","width","height"):
+            if k not in spec:
+                raise ValueError(f"job needs {k !r}")
+        for k in spec.get("outputs", {}):
+            if k not in OUTPUTS:
+                raise ValueError(f"unknown output {k !r}")
+        self.id = id or uuid.uuid4().hex
+        self.spec = spec
+        self.priority = priority
+        self.state = None
+        self._listeners = []
+        self._done = trio.Event()
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.state}>"
+
+    def listen(self, send):
+        """Send this job's messages to the memory channel `send`"""
+        self._listeners.append(send)
+
+    def notify(self, state:str, **kw):
+        self.state = state
+        msg = dict(id=self.id, state=state, **kw)
+        for send in self._listeners:
+            try:
+                send.send_nowait(msg)
+            except (trio.BrokenResourceError, trio.ClosedResourceError):
+                pass
+        if state in FINAL:
+            self._done.set()
+
+    @property
+    def finished(self):
+        return self._done.is_set()
+
+    async def wait(self):
+        await self._done.wait()
+
+
+class RenderService:
+    """
+    Render jobs on a pool of `instances` warm Fractal instances.
+
+    Call `run` in a task; it doesn't return.
+    """
+    def __init__(self, instances:int = 1, progress_interval:float = 0.5, factory=Fractal):
+        self.instances = instances
+        self.progress_interval = progress_interval
+        self.factory = factory
+        self.jobs = {}  # id => Job, until it's finished
+        self._heap = []
+        self._seq = itertools.count()
+        self._idle = []
+        self._loaded = {}  # id(kf) => (settings, location) of its last job
+        self._defaults = {}  # id(kf) => its settings before the first job
+        self._changed = trio.Event()
+
+    async def run(self, task_status=trio.TASK_STATUS_IGNORED):
+        async with trio.open_nursery() as n:
+            for _ in range(self.instances):
+                kf = self.factory()
+                kf.n = n
+                self._defaults[id(kf)] = kf.settings_str
+                self._idle.append(kf)
+            task_status.started(self)
+
+            while True:
+                while self._heap and self._idle:
+                    _,_,job = heapq.heappop(self._heap)
+                    if job.cancelled:
+                        continue
+                    n.start_soon(self._run, self._pick(job), job)
+                self._changed = trio.Event()
+                await self._changed.wait()
+
+    def submit(self, spec:dict, id:str = None, priority:int = 0, listener=None) -> Job:
+        """Queue a job. Its messages are sent to the memory channel `listener`."""
+        job = Job(spec, id=id, priority=priority)
+        if job.id in self.jobs:
+            raise ValueError(f"job {job.id !r} exists")
+        if listener is not None:
+            job.listen(listener)
+        self.jobs[job.id] = job
+        heapq.heappush(self._heap, (-priority, next(self._seq), job))
+        job.notify("queued")
+        self._changed.set()
+        return job
+
+    def cancel(self, id:str) -> bool:
+        """Cancel a job. Returns False if there's no such job."""
+        job = self.jobs.get(id)
+        if job is None:
+            return False
+        job.cancelled = True
+        if job.kf is not None:
+            job.kf.request_stop()
+        else:
+            del self.jobs[id]
+            job.notify("cancelled")
+        return True
+
+    def _pick(self, job):
+        """Take the idle instance that's best suited to `job`"""
+        want = (job.spec.get("settings"), job.spec["location"])
+        for i,kf in enumerate(self._idle):
+            # same settings and location: the reference orbit may be re-used
+            if self._loaded.get(id(kf)) == want:
+                return self._idle.pop(i)
+        for i,kf in enumerate(self._idle):
+            if self._loaded.get(id(kf), (None,None))[0] == want[0]:
+                return self._idle.pop(i)
+        return self._idle.pop(0)
+
+    async def _run(self, kf, job):
+        job.kf = kf
+        job.notify("rendering")
+        try:
+            async with trio.open_nursery() as n:
+                n.start_soon(self._progress, kf, job)
+                # errors are handled in here: leaving the nursery would wrap
+                # them in an ExceptionGroup (with strict_exception_groups)
+                try:
+                    await self._render(kf, job)
+                except RenderStoppedError:
+                    res = ("cancelled", {})
+                except Exception as exc:
+                    kf.log("error", "job %s failed: %r", job.id, exc)
+                    res = ("failed", dict(error=str(exc)))
+                else:
+                    stats = kf.render_stats
+                    res = ("done", dict(stats=stats.to_dict() if stats is not None else None))
+                finally:
+                    n.cancel_scope.cancel()
+            job.notify(res[0], **res[1])
+        finally:
+            job.kf = None
+            self.jobs.pop(job.id, None)
+            self._idle.append(kf)
+            self._changed.set()
+
+    async def _render(self, kf, job):
+        spec = job.spec
+        async with kf.render_lock(name=f"job {job.id}"):
+            settings = spec.get("settings") or None
+            self._loaded.pop(id(kf), None)
+            size = (int(spec["width"]), int(spec["height"]))
+
+            def load():
+                # a job without settings gets the defaults, not the last
+                # job's. Compare with the live settings: saving may have
+                # changed some (e.g. half_colour).
+                want = settings or self._defaults[id(kf)]
+                if kf.settings_str != want:
+                    kf.settings_str = want
+                kf.openString(spec["location"])
+                if spec.get("palette"):
+                    kf.openString(spec["palette"], noLocation=True)
+                # no supersampling: save_frame saves at the target size
+                kf.target_dimensions = size+(1,)
+                if kf.getImageSize() != size:
+                    kf.setImageSize(*size)
+            await trio.to_thread.run_sync(load)
+            self._loaded[id(kf)] = (settings, spec["location"])
+        if job.cancelled:
+            raise RenderStoppedError()
+
+        await kf.render(name=f"job {job.id}", kill=False, color=False)
+
+        save_args = {OUTPUTS[k]:v for k,v in spec.get("outputs", {}).items()}
+        if "quality" in spec:
+            save_args["quality"] = spec["quality"]
+        async with kf.render_lock(name=f"job {job.id} save"):
+            if job.cancelled:
+                raise RenderStoppedError()
+            await kf.save_frame(0, not spec.get("outputs"), **save_args)
+
+    async def _progress(self, kf, job):
+        while True:
+            await trio.sleep(self.progress_interval)
+            if kf.is_rendering:
+                job.notify("progress", progress=kf.getProgress())
+
+    def request(self, msg:dict, send):
+        """
+        Process a client request. Replies go to the memory channel `send`.
+
+        Returns the job, if one was submitted.
+        """
+        action = msg.get("action", "render")
+        try:
+            if action == "render":
+                spec = {k:v for k,v in msg.items() if k not in ("action","id","priority")}
+                return self.submit(spec, id=msg.get("id"), priority=msg.get("priority", 0), listener=send)
+            elif action == "cancel":
+                send.send_nowait(dict(id=msg.get("id"), state="cancel", ok=self.cancel(msg.get("id"))))
+            elif action == "status":
+                send.send_nowait(dict(state="status", jobs={j.id:j.state for j in self.jobs.values()}))
+            else:
+                raise ValueError(f"unknown action {action !r}")
+        except (ValueError, KeyError, TypeError) as exc:
+            send.send_nowait(dict(id=msg.get("id"), state="failed", error=str(exc)))
+
+    async def handle(self, stream):
+        """Serve one client connection"""
+        send, recv = trio.open_memory_channel(math.inf)
+        jobs = []
+
+        async def writer():
+            try:
+                async for msg in recv:
+                    await stream.send_all(json.dumps(msg).encode("utf-8")+b"\n")
+            except (trio.BrokenResourceError, trio.ClosedResourceError):
+                # the client is gone
+                for job in jobs:
+                    self.cancel(job.id)
+
+        async with trio.open_nursery() as n:
+            n.start_soon(writer)
+            buf = b""
+            try:
+                async for data in stream:
+                    buf += data
+                    while b"\n" in buf:
+                        line,buf = buf.split(b"\n",1)
+                        if not line.strip():
+                            continue
+                        try:
+                            msg = json.loads(line)
+                        except ValueError as exc:
+                            send.send_nowait(dict(state="failed", error=str(exc)))
+                            continue
+                        job = self.request(msg, send)
+                        if job is not None:
+                            jobs.append(job)
+            except trio.BrokenResourceError:
+                pass
+            for job in jobs:
+                await job.wait()
+            await send.aclose()
+        await stream.aclose()
+
+
+async def serve(path:str, instances:int = 1, task_status=trio.TASK_STATUS_IGNORED, **kw):
+    """Run a render service on the unix socket `path`"""
+    service = RenderService(instances, **kw)
+    async with trio.open_nursery() as n:
+        await n.start(service.run)
+
+        if os.path.exists(path):
+            os.unlink(path)
+        sock = trio.socket.socket(trio.socket.AF_UNIX, trio.socket.SOCK_STREAM)
+        await sock.bind(path)
+        sock.listen()
+        task_status.started(service)
+        try:
+            await trio.serve_listeners(service.handle, [trio.SocketListener(sock)])
+        finally:
+            os.unlink(path)
+
+
+class LocalClient:
+    """
+    An in-process stand-in for a socket client, e.g. for testing.
+
+    Requests and replies are the same dicts the socket protocol uses.
+    """
+    def __init__(self, service:RenderService):
+        self.service = service
+        self._send, self._recv = trio.open_memory_channel(math.inf)
+        self._backlog = []
+
+    def request(self, **msg):
+        return self.service.request(msg, self._send)
+
+    def render(self, location:str, width:int, height:int, **kw) -> str:
+        """Submit a job; returns its ID"""
+        job = self.request(action="render", location=location, width=width, height=height, **kw)
+        if job is None:
+            raise RuntimeError(self._recv.receive_nowait().get("error"))
+        return job.id
+
+    def cancel(self, id:str) -> bool:
+        return self.service.cancel(id)
+
+    async def receive(self) -> dict:
+        """The next message"""
+        if self._backlog:
+            return self._backlog.pop(0)
+        return await self._recv.receive()
+
+    async def wait(self, id:str) -> dict:
+        """
+        Wait for job `id` to finish. Returns its last message.
+
+        Other jobs' messages are kept for `receive`.
+        """
+        for i,msg in enumerate(self._backlog):
+            if msg.get("id") == id and msg.get("state") in FINAL:
+                del self._backlog[i]
+                return msg
+        while True:
+            msg = await self._recv.receive()
+            if msg.get("id") == id and msg.get("state") in FINAL:
+                return msg
+            self._backlog.append(msg)
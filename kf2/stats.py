@@ -0,0 +1,167 @@
+##
+# Render statistics.
+#
+# The library keeps cumulative wall/CPU timers for the reference,
+# approximation and perturbation phases, plus a progress breakdown of
+# good, guessed and bad pixels. `RenderStats` snapshots these after each
+# render pass so that the cost of every glitch-correction pass is visible.
+##
+
+import json
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Optional
+
+PHASES = ("reference", "approximation", "perturbation")
+
+
+@dataclass
+class PassStats:
+    """One render pass: the initial one, or a glitch correction."""
+    reference: int
+    # Number of the reference orbit this pass used; 1 is the primary one
+
+    x: Optional[int] = None
+    y: Optional[int] = None
+    glitch_size: Optional[int] = None
+    # Where the glitch correction reference was placed, and the size of
+    # the glitch it was supposed to fix
+
+    wall: float = 0
+    # Wall time of this pass, measured by us
+
+    phases: dict = field(default_factory=dict)
+    # phase name => [wall, cpu] seconds spent in this pass, per the library
+
+
+@dataclass
+class RenderStats:
+    """Statistics of a single call to `Fractal._render_`."""
+    name: str = ""
+    width: int = 0
+    height: int = 0
+    iterations: int = 0
+    center_re: str = ""
+    center_im: str = ""
+    zoom: str = ""
+
+    started: float = 0
+    # Unix time
+
+    wall: float = 0
+    colouring: float = 0
+    stopped: bool = False
+
+    stop_latency: Optional[float] = None
+    # seconds from the stop request until the render actually stopped
+
+    resumed: Optional[int] = None
+    # if this render continued a stopped one: the number of pixels left
+
+    passes: list = field(default_factory=list)
+    phases: dict = field(default_factory=dict)
+    # phase name => [wall, cpu] totals
+
+    progress: dict = field(default_factory=dict)
+    # the library's final progress report, in percent
+
+    _t0: float = field(default=0, repr=False)
+    _last: dict = field(default_factory=dict, repr=False)
+
+    @property
+    def references(self):
+        """Number of reference orbits used"""
+        return len(self.passes)
+
+    @property
+    def guessed_ratio(self):
+        """Fraction of pixels that were guessed instead of calculated"""
+        p = self.progress
+        return (p.get("good_guessed", 0) + p.get("bad_guessed", 0)) / 100
+
+    def begin(self, kf, name):
+        self.name = name
+        self.width, self.height = kf.getImageSize()
+        self.iterations = kf.iterations
+        self.center_re = str(kf.center_re)
+        self.center_im = str(kf.center_im)
+        self.zoom = kf.toZoom().decode("utf-8")
+        self.started = time.time()
+        self._t0 = time.monotonic()
+        kf.resetTimers()
+        self._last = _timers(kf)
+
+    def pass_done(self, kf, reference, t_start, x=None, y=None, glitch_size=None):
+        """Record a pass that started at (monotonic) `t_start`"""
+        now = _timers(kf)
+        p = PassStats(reference=reference, x=x, y=y, glitch_size=glitch_size,
+                wall=time.monotonic()-t_start)
+        for ph in PHASES:
+            p.phases[ph] = [now[ph][0]-self._last[ph][0], now[ph][1]-self._last[ph][1]]
+        self._last = now
+        self.passes.append(p)
+
+    def end(self, kf, stopped):
+        self.wall = time.monotonic()-self._t0
+        self.stopped = bool(stopped)
+        self.phases = {ph:list(v) for ph,v in _timers(kf).items()}
+        self.progress = kf.getProgress()
+
+    def to_dict(self):
+        res = asdict(self)
+        del res["_t0"]
+        del res["_last"]
+        res["references"] = self.references
+        res["guessed_ratio"] = self.guessed_ratio
+        return res
+
+    def append_to(self, path):
+        """Append these stats to a file, as one line of JSON"""
+        with open(path, "a") as f:
+            f.write(json.dumps(self.to_dict()))
+            f.write("\n")
+
+
+def _timers(kf):
+    t = kf.getTimers()
+    return {ph:(t[ph+"_wall"],t[ph+"_cpu"]) for ph in PHASES+("total",)}
+
+
+class LatencyHistogram:
+    """
+    A histogram of latencies, in power-of-two buckets.
+
+    Bucket `k` counts the latencies below 2**k microseconds (and not in
+    a lower bucket).
+    """
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds:float):
+        k = int(seconds*1e6).bit_length()
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.max < seconds:
+            self.max = seconds
+
+    @property
+    def mean(self):
+        return self.total/self.count if self.count else 0
+
+    def percentile(self, p:float) -> float:
+        """The upper bound of the bucket holding the p-th percentile, in seconds"""
+        n = self.count*p/100
+        seen = 0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if seen >= n:
+                return (1<<k)/1e6
+        return 0
+
+    def to_dict(self):
+        return dict(count=self.count, mean=self.mean, max=self.max,
+                buckets={(1<<k)/1e6: n for k,n in sorted(self.buckets.items())})
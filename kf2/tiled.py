@@ -0,0 +1,232 @@
+##
+# Tiled rendering, for images that don't fit into memory.
+#
+# The image is rendered one tile at a time: each tile is a separate render
+# of a sub-view, set up with `setPosition`. Finished tiles are streamed to
+# a tiled TIFF file, so peak memory is one tile's buffers plus the
+# reference orbit.
+#
+# The primary reference is computed once, at the image center, by a tiny
+# preview render. The tiles then re-use it via `reuse_reference`. A tile
+# that needed glitch correction leaves a secondary reference behind, so
+# the tile after it computes a new one.
+##
+
+import struct
+import zlib
+
+import gmpy2
+
+TILE_MULTIPLE = 16
+# TIFF requires tile sizes to be multiples of 16
+
+TILE_MARGIN = 4
+# tiles are rendered this many pixels larger on each side, and cropped:
+# colouring (slopes, DE) looks at neighbouring pixels, which at a tile's
+# edge would be one-sided
+
+
+class TiledTIFFWriter:
+    """
+    Write an 8-bit RGB tiled TIFF, one tile at a time, in any order.
+
+    Files that may exceed 4 GiB are written as BigTIFF.
+    """
+    def __init__(self, path, width:int, height:int, tile:int = 256, compress:bool = True, bigtiff:bool = None):
+        if tile % TILE_MULTIPLE:
+            raise ValueError(f"tile size must be a multiple of {TILE_MULTIPLE}")
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.compress = compress
+        self.tiles_x = (width+tile-1)//tile
+        self.tiles_y = (height+tile-1)//tile
+        if bigtiff is None:
+            bigtiff = self.tiles_x*self.tiles_y*tile*tile*3 >= (1<<32) - (1<<20)
+        self.bigtiff = bigtiff
+        self.offsets = [0]*(self.tiles_x*self.tiles_y)
+        self.counts = [0]*(self.tiles_x*self.tiles_y)
+
+        self.f = open(path, "wb")
+        if bigtiff:
+            self.f.write(b"II" + struct.pack("<HHHQ", 43, 8, 0, 0))
+        else:
+            self.f.write(b"II" + struct.pack("<HI", 42, 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *tb):
+        if tb[0] is None:
+            self.close()
+        else:
+            self.f.close()
+
+    def write_tile(self, tx:int, ty:int, rgb):
+        """
+        Write the tile at column `tx`, row `ty`.
+
+        `rgb` is a top-down (h,w,3) uint8 array. Tiles at the right and
+        bottom edge may be smaller than the tile size; they are padded.
+        """
+        import numpy
+
+        t = self.tile
+        h,w,_ = rgb.shape
+        if h != t or w != t:
+            buf = numpy.zeros((t,t,3), numpy.uint8)
+            buf[:h,:w] = rgb
+            rgb = buf
+        data = numpy.ascontiguousarray(rgb).tobytes()
+        if self.compress:
+            data = zlib.compress(data, 6)
+
+        i = ty*self.tiles_x+tx
+        self.f.seek(0, 2)
+        self.offsets[i] = self.f.tell()
+        self.counts[i] = len(data)
+        self.f.write(data)
+
+    def close(self):
+        """Write the directory, then close the file"""
+        if 0 in self.counts:
+            raise RuntimeError("not all tiles have been written")
+        f = self.f
+        f.seek(0, 2)
+        if f.tell() & 1:
+            f.write(b"\0")
+
+        big = self.bigtiff
+        off = "Q" if big else "I"
+        off_type = 16 if big else 4
+        n = len(self.offsets)
+
+        bps_pos = f.tell()
+        f.write(struct.pack("<3H", 8,8,8))
+        if f.tell() & 1:
+            f.write(b"\0")
+        offsets_pos = f.tell()
+        f.write(struct.pack(f"<{n}{off}", *self.offsets))
+        counts_pos = f.tell()
+        f.write(struct.pack(f"<{n}{off}", *self.counts))
+
+        if n == 1:
+            # single values are stored inline
+            offsets_val, counts_val = self.offsets[0], self.counts[0]
+        else:
+            offsets_val, counts_val = offsets_pos, counts_pos
+        tags = [
+            (256, 4, 1, self.width),
+            (257, 4, 1, self.height),
+            (258, 3, 3, bps_pos),
+            (259, 3, 1, 8 if self.compress else 1),
+            (262, 3, 1, 2),  # RGB
+            (277, 3, 1, 3),
+            (284, 3, 1, 1),  # contiguous
+            (322, 4, 1, self.tile),
+            (323, 4, 1, self.tile),
+            (324, off_type, n, offsets_val),
+            (325, off_type, n, counts_val),
+        ]
+
+        ifd_pos = f.tell()
+        if big:
+            f.write(struct.pack("<Q", len(tags)))
+            for tag,typ,count,val in tags:
+                if tag == 258:
+                    # fits into the entry
+                    f.write(struct.pack("<HHQ3H2x", tag,typ,count,8,8,8))
+                elif typ == 3 and count == 1:
+                    f.write(struct.pack("<HHQH6x", tag,typ,count,val))
+                elif typ == 4 and count == 1:
+                    f.write(struct.pack("<HHQI4x", tag,typ,count,val))
+                else:
+                    f.write(struct.pack("<HHQQ", tag,typ,count,val))
+            f.write(struct.pack("<Q", 0))
+            f.seek(8)
+            f.write(struct.pack("<Q", ifd_pos))
+        else:
+            f.write(struct.pack("<H", len(tags)))
+            for tag,typ,count,val in tags:
+                if typ == 3 and count == 1:
+                    f.write(struct.pack("<HHIH2x", tag,typ,count,val))
+                else:
+                    f.write(struct.pack("<HHII", tag,typ,count,val))
+            f.write(struct.pack("<I", 0))
+            f.seek(4)
+            f.write(struct.pack("<I", ifd_pos))
+        f.close()
+
+
+def tile_position(re, im, radius, width:int, height:int, x0:int, y0:int, tile:int, margin:int = 0):
+    """
+    The center and radius of the tile whose top left pixel is (x0,y0),
+    in an image of the given size centered on (re,im).
+
+    With a `margin`, the radius is that of the tile plus the margin on
+    each side.
+
+    As in KF, the radius is half the image height.
+    """
+    prec = max(re.precision, im.precision) + 32
+    with gmpy2.local_context(gmpy2.get_context(), precision=prec):
+        step = 2*radius/height
+        tre = re + (x0 + tile/2 - width/2)*step
+        tim = im - (y0 + tile/2 - height/2)*step
+        trad = radius*(tile+2*margin)/height
+    return tre, tim, trad
+
+
+async def render_tiled(kf, path, width:int, height:int, tile:int = 512, compress:bool = True):
+    """
+    Render the current location at `width`×`height` into a tiled TIFF,
+    one tile at a time.
+
+    Transformations (rotation, skew) and exponential maps are not
+    supported.
+
+    The iteration limit is set once, by a small render of the whole
+    image; tiles don't adjust it, so they match.
+    """
+    sign,scale,rotate,stretch,_ = kf.transform_polar
+    if sign < 0 or rotate != 0 or stretch != 1:
+        raise RuntimeError("tiled rendering doesn't support rotation or skew")
+    if kf.exponential_map:
+        raise RuntimeError("tiled rendering doesn't support exponential maps")
+
+    re,im,radius = kf.center_re, kf.center_im, kf.zoom_radius
+    size = kf.getImageSize()
+    reuse = kf.reuse_reference
+    auto_iter = kf.auto_iterations
+    m = TILE_MARGIN
+
+    with TiledTIFFWriter(path, width, height, tile=tile, compress=compress) as out:
+        try:
+            # compute the primary reference, at the image center
+            async with kf.render_lock(name="tiles pre"):
+                kf.setImageSize(64, 64*height//width or 1)
+                await kf.render_locked(name="tiles pre", color=False)
+                kf.auto_iterations = False
+
+            reuse_next = True
+            for ty in range(out.tiles_y):
+                for tx in range(out.tiles_x):
+                    x0,y0 = tx*tile, ty*tile
+                    async with kf.render_lock(name="tile"):
+                        if kf.getImageSize() != (tile+2*m,tile+2*m):
+                            kf.setImageSize(tile+2*m,tile+2*m)
+                        kf.reuse_reference = reuse_next
+                        kf.setPosition(*tile_position(re, im, radius, width, height, x0, y0, tile, m))
+                        await kf.render_locked(name=f"tile {tx},{ty}")
+
+                        kf.log("info", "tile %d,%d done", tx,ty)
+                        rgb = kf.rgb_view
+                        out.write_tile(tx, ty, rgb[m:m+min(tile,height-y0), m:m+min(tile,width-x0)])
+                        stats = kf.render_stats
+                        reuse_next = stats is None or stats.references == 1
+        finally:
+            async with kf.render_lock(name="tiles end"):
+                kf.reuse_reference = reuse
+                kf.auto_iterations = auto_iter
+                kf.setPosition(re, im, radius)
+                kf.setImageSize(*size)
@@ -0,0 +1,127 @@
+##
+# Tracing.
+#
+# Spans (named intervals) and instant events are recorded into a ring
+# buffer, with the thread they happened in. The buffer can be exported as
+# Chrome trace-event JSON, for chrome://tracing or Perfetto.
+#
+# A span's arguments are stored as they are and only converted when the
+# trace is exported. While tracing is off, `span` returns a shared no-op
+# context manager and records nothing.
+#
+# Usage:
+#
+#   from kf2.trace import tracer
+#   with tracer.span("colour", frame=n):
+#       ...
+#   tracer.save("trace.json")
+##
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *tb):
+        return False
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("events", "name", "args", "start")
+
+    def __init__(self, events, name, args):
+        self.events = events
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *tb):
+        end = time.perf_counter_ns()
+        # deque.append is atomic, so spans may end in any thread
+        self.events.append(("X", self.name, self.start, end-self.start, threading.get_ident(), self.args))
+        return False
+
+
+class Tracer:
+    """
+    A ring buffer of trace events.
+
+    size: the number of events kept; older ones are dropped.
+    """
+    def __init__(self, size:int = 100000):
+        self.enabled = False
+        self._events = deque(maxlen=size)
+        self._threads = {}
+        self._t0 = time.perf_counter_ns()
+
+    def enable(self, on:bool = True):
+        self.enabled = on
+        if on:
+            self._name_thread()
+
+    def clear(self):
+        self._events.clear()
+
+    def _name_thread(self):
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+
+    def span(self, name:str, **args):
+        """A context manager that records the time spent in it"""
+        if not self.enabled:
+            return _NO_SPAN
+        self._name_thread()
+        return _Span(self._events, name, args)
+
+    def instant(self, name:str, **args):
+        """Record a point in time"""
+        if not self.enabled:
+            return
+        self._name_thread()
+        self._events.append(("i", name, time.perf_counter_ns(), 0, threading.get_ident(), args))
+
+    def to_chrome(self) -> dict:
+        """The events, as a Chrome trace-event document"""
+        pid = os.getpid()
+        res = []
+        for tid,name in self._threads.items():
+            res.append(dict(ph="M", name="thread_name", pid=pid, tid=tid, args=dict(name=name)))
+        for ph,name,start,dur,tid,args in list(self._events):
+            ev = dict(ph=ph, name=name, pid=pid, tid=tid, ts=(start-self._t0)/1000)
+            if ph == "X":
+                ev["dur"] = dur/1000
+            else:
+                ev["s"] = "t"
+            if args:
+                ev["args"] = {k:_jsonable(v) for k,v in args.items()}
+            res.append(ev)
+        return dict(traceEvents=res, displayTimeUnit="ms")
+
+    def save(self, path):
+        """Write the events to a Chrome trace-event JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.to_chrome(), f)
+
+
+def _jsonable(v):
+    if v is None or isinstance(v, (bool, int, float, str)):
+        return v
+    return repr(v)
+
+
+tracer = Tracer()
+# the global tracer
@@ -13,7 +13,8 @@ import trio
 
 from PIL import Image
 
-from .impl import ApplySize, ApplyZoom, ApplyWork
+from .impl import ApplySize, ApplyZoom, ApplyWork, ApplyView
+from .cache import RenderCache
 
 class UI:
     render_updater = None
@@ -22,6 +23,15 @@ class UI:
 
     def __init__(self, kf):
         self.kf = kf
+        # views to go back / forward to, as params_str.
+        # The render cache makes returning to them instant.
+        self.history = []
+        self.future = []
+        if kf.render_cache is None:
+            kf.render_cache = RenderCache()
+        if not kf.progressive:
+            kf.progressive = (8, 3)
+        kf.on_preview = self.draw_fractal
         self.widgets = gtk.Builder()
         self.widgets.add_from_file("kf2/kf2.glade")
 
@@ -63,14 +73,18 @@ class UI:
             x,y = btn.get_coords()
             
             r = area.get_allocation()
-            self.kf.do_work(ApplyZoom(x*self.kf.nX/r.width, y*self.kf.nY/r.height, self.kf.zoom_size))
+            nx,ny = self.kf.render_size
+            self.remember_view()
+            self.kf.do_work(ApplyZoom(x*nx/r.width, y*ny/r.height, self.kf.zoom_size))
             self.start_render_updater()
         elif t.direction == gdk.ScrollDirection.DOWN:  # zoom out
             self.kf.log("debug","SCROLL %r %r",btn.get_scroll_direction(),btn.get_coords())
             x,y = btn.get_coords()
             
             r = area.get_allocation()
-            self.kf.do_work(ApplyZoom(x*self.kf.nX/r.width, y*self.kf.nY/r.height, 1/self.kf.zoom_size))
+            nx,ny = self.kf.render_size
+            self.remember_view()
+            self.kf.do_work(ApplyZoom(x*nx/r.width, y*ny/r.height, 1/self.kf.zoom_size))
             self.start_render_updater()
         else:
             self.kf.log("debug","SCROLL %r %r",btn.get_scroll_direction(),btn.get_coords())
@@ -109,6 +123,40 @@ class UI:
 
     def on_img_button(self, area, btn):
         self.kf.log("debug","BTN %r",btn.button)
+        if btn.button == 8:
+            self.go_back()
+        elif btn.button == 9:
+            self.go_forward()
+
+    def remember_view(self):
+        """
+        Note the current view before moving away from it.
+
+        Zooms that are queued but not applied yet haven't changed the
+        view, so a burst of them is one step.
+        """
+        self._push(self.history)
+        self.future = []
+
+    def go_back(self):
+        if not self.history:
+            return
+        self._push(self.future)
+        self.kf.do_work(ApplyView(self.history.pop()))
+        self.start_render_updater()
+
+    def go_forward(self):
+        if not self.future:
+            return
+        self._push(self.history)
+        self.kf.do_work(ApplyView(self.future.pop()))
+        self.start_render_updater()
+
+    def _push(self, stack):
+        # a view change that's still queued hasn't changed params_str yet
+        view = self.kf.params_str
+        if not stack or stack[-1] != view:
+            stack.append(view)
 
     def on_img_button_release(self, area, btn):
         self.kf.log("debug","!BTN %r",btn)
@@ -118,8 +166,23 @@ class UI:
             self.kf.log("debug","NODRAW %s",self.skip_update)
             return True
         # self.kf.log("debug","DRAW")
+        prev = self.kf.display_image()
         try:
-            img = cairo.ImageSurface.create_for_data(self.kf.image_bytes, cairo.FORMAT_RGB24, self.kf.image_width, self.kf.image_height)
+            if prev is not None:
+                # a render is running: show its preview, scaled up, with
+                # the pixels that are done on top
+                ih,iw,_ = prev.shape
+                img = cairo.ImageSurface.create_for_data(memoryview(prev), cairo.FORMAT_RGB24, iw, ih)
+            else:
+                iw,ih = self.kf.image_width, self.kf.image_height
+                r = area.get_allocation()
+                f = max(r.width/iw, r.height/ih)
+                if f < .5 and not self.kf.is_rendering:
+                    # supersampled: cairo's scaling would alias
+                    iw,ih = max(round(iw*f),1), max(round(ih*f),1)
+                    img = cairo.ImageSurface.create_for_data(memoryview(self.kf.downscale(iw,ih)), cairo.FORMAT_RGB24, iw, ih)
+                else:
+                    img = cairo.ImageSurface.create_for_data(self.kf.image_bytes, cairo.FORMAT_RGB24, iw, ih)
         except TypeError:
             print("No image data?", file=sys.stderr)
             breakpoint()
@@ -131,16 +194,16 @@ class UI:
         rr = area.get_allocated_size()[0]
         m.y0 = r.height
         m.translate(rr.x,-rr.y)
-        sx = r.width/self.kf.image_width
-        sy = r.height/self.kf.image_height
+        sx = r.width/iw
+        sy = r.height/ih
 
         if sx < sy:
             m.scale(sy,sy)
-            m.x0 += (sx-sy)*self.kf.image_width/2
+            m.x0 += (sx-sy)*iw/2
         else:
             m.scale(sx,sx)
             if sx > sy:
-                m.y0 -= (sy-sx)*self.kf.image_height/2
+                m.y0 -= (sy-sx)*ih/2
 
         # self.kf.log("debug","DRAW %r", m)
         ctx.set_matrix(m)
@@ -212,7 +275,7 @@ class UI:
             self.kf.log("debug","RESZ A %r %r", self.kf.getImageSize(), (w,h))
             async with self.kf.render_lock(kill=True, run=False, name="UI resize"):
                 self.kf.log("debug","RESZ B %d %d", w,h)
-                self.kf.setImageSize(*self.resized[1:3])
+                await trio.to_thread.run_sync(self.kf.setImageSize, *self.resized[1:3])
                 self.start_render_updater()
                 await self.kf.render_locked(stop_ok=True,name="Resizer")
         self.kf.log("debug","RESZ X")
@@ -255,8 +318,7 @@ class UI:
     async def run(self):
         self.done = trio.Event()
         self['main'].show_all()
-        async with self.kf.render_lock():
-            self.kf.setImageSize(*self.kf.target_dimensions[0:2])
+        await self.kf.async_setImageSize(*self.kf.target_dimensions[0:2])
         self.kf.do_work(ApplyWork(done=self._minsize))
         self.resize_viewport_to_fractal()
         self.start_render_updater()
@@ -0,0 +1,142 @@
+##
+# Zoom sequences rendered by a pool of worker processes.
+#
+# Each worker owns its own Fractal, set up from the parent's settings and
+# parameter text. Frames don't depend on each other: frame N's radius is
+# the initial radius times zoom_size**N, so a worker can render any frame
+# it is handed.
+#
+# The parent hands out frame numbers, logs progress, and re-submits frames
+# that failed, including those lost when a worker process died.
+##
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+import trio
+import gmpy2
+
+_kf = None
+_origin = None
+
+
+def _init(settings:str, params:str, dims:tuple, log_level:int, origin:tuple):
+    """Worker process setup"""
+    global _kf, _origin
+    from .impl import Fractal
+
+    _kf = kf = Fractal()
+    kf.log_level = log_level
+    kf.settings_str = settings
+    # not params_str: that ignores the location
+    kf.openString(params)
+
+    async def setup():
+        async with kf.render_lock(name="worker init"):
+            x,y,s = dims
+            kf.target_dimensions = dims
+            kf.setImageSize(x*s,y*s)
+    trio.run(setup)
+
+    # the parent's numbers are authoritative; the text round trip may
+    # have rounded them, but it must not have lost the location
+    re,im,radius = origin
+    if abs(kf.center_re-re) > radius/1000 or abs(kf.center_im-im) > radius/1000 \
+            or abs(kf.zoom_radius-radius) > radius/1000:
+        raise RuntimeError(f"worker location {kf.center_re},{kf.center_im} r={kf.zoom_radius} "
+                f"doesn't match {re},{im} r={radius}")
+    _origin = (re, im, radius, kf.jitter_seed)
+
+
+def _frame(frame:int, only_kfr:bool, save_args:dict):
+    """Render and save a single frame, in a worker process"""
+    kf = _kf
+    re,im,radius,jitter = _origin
+
+    async def run():
+        t = time.monotonic()
+        async with kf.render_lock(name="worker frame"):
+            if jitter:
+                kf.jitter_seed = jitter + frame
+            kf.setPosition(re, im, radius * gmpy2.mpfr(kf.zoom_size)**frame)
+        kf.inhibit_colouring = True
+        kf.interactive = False
+        if not only_kfr:
+            await kf.render()
+        await kf.save_frame(frame, only_kfr, **save_args)
+        return time.monotonic()-t
+
+    return os.getpid(), trio.run(run)
+
+
+def sequence_length(kf, frames:int, min_zoom:float = .001) -> int:
+    """
+    The number of frames `Fractal.render_sequence` would render.
+    """
+    radius = kf.zoom_radius
+    zs = gmpy2.mpfr(kf.zoom_size)
+    for frame in range(1,frames):
+        if 2/(radius * zs**(frame-1)) < min_zoom:
+            return frame
+    return frames
+
+
+def render_parallel(kf, frames:int, only_kfr:bool, workers:int, retries:int = 2,
+        min_zoom:float = .001, **save_args) -> dict:
+    """
+    Render a zoom-out sequence with `workers` processes.
+
+    `kf` supplies settings, location and image size; it is not modified.
+    Each frame is tried up to `retries`+1 times.
+
+    Blocks. Returns a dict frame => exception of the frames that
+    failed for good.
+    """
+    todo = list(range(sequence_length(kf, frames, min_zoom)))
+    init = (kf.settings_str, kf.params_str, kf.target_dimensions, kf.log_level,
+            (kf.center_re, kf.center_im, kf.zoom_radius))
+    ctx = multiprocessing.get_context("spawn")
+    tries = {}
+    failed = {}
+
+    while todo:
+        pending = {}
+        with ProcessPoolExecutor(workers, mp_context=ctx, initializer=_init, initargs=init) as pool:
+            try:
+                while todo or pending:
+                    while todo and len(pending) < 2*workers:
+                        frame = todo.pop(0)
+                        tries[frame] = tries.get(frame,0)+1
+                        pending[pool.submit(_frame, frame, only_kfr, save_args)] = frame
+
+                    done,_ = wait(pending, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        frame = pending[f]
+                        try:
+                            pid,t = f.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as exc:
+                            del pending[f]
+                            _retry(kf, frame, exc, tries, retries, todo, failed)
+                        else:
+                            del pending[f]
+                            kf.log("info", "frame %d done by %d, %.2f sec", frame, pid, t)
+            except BrokenProcessPool as exc:
+                # a worker died: the pool is unusable, so start a new one
+                kf.log("warn", "worker pool broken, restarting")
+                for frame in sorted(pending.values()):
+                    _retry(kf, frame, exc, tries, retries, todo, failed)
+    return failed
+
+
+def _retry(kf, frame, exc, tries, retries, todo, failed):
+    if tries[frame] > retries:
+        kf.log("error", "frame %d failed: %r", frame, exc)
+        failed[frame] = exc
+    else:
+        kf.log("warn", "frame %d failed, retrying: %r", frame, exc)
+        todo.append(frame)
@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("kf2.core")  # importing kf2 needs the compiled library
+
+from kf2.bench import compare
+
+
+def _result(wall=1.0, refs=1, rss=100<<20, phases=None, scale=1):
+    res = dict(width=64, height=36, wall=wall, references=refs, iterations=1000,
+            phases=phases or {}, colouring=.1, save_exr=.2, pil_image=.01, png=.05,
+            peak_rss=rss)
+    return dict(scale=scale, results=dict(shallow=res))
+
+
+def test_compare_same():
+    assert compare(_result(), _result()) == []
+
+
+def test_compare_slower():
+    bad = compare(_result(wall=2.0), _result(wall=1.0))
+    assert len(bad) == 1 and "wall" in bad[0]
+
+
+def test_compare_small_delta():
+    # 50% slower, but by less than MIN_DELTA
+    assert compare(_result(wall=.03), _result(wall=.02)) == []
+
+
+def test_compare_phases():
+    bad = compare(_result(phases={"reference": (3.0, 3.0)}), _result(phases={"reference": (1.0, 1.0)}))
+    assert len(bad) == 1 and "reference" in bad[0]
+
+
+def test_compare_references_and_rss():
+    bad = compare(_result(refs=3, rss=200<<20), _result())
+    assert len(bad) == 2
+    assert "references 1 → 3" in bad[0]
+    assert "100 → 200 MiB" in bad[1]
+
+
+def test_compare_scale():
+    bad = compare(_result(scale=.5), _result())
+    assert len(bad) == 1 and "scale" in bad[0]
+
+
+def test_compare_new_location():
+    cur = _result()
+    cur["results"]["deep"] = cur["results"]["shallow"]
+    assert compare(cur, _result()) == []
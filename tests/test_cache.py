@@ -0,0 +1,50 @@
+import numpy
+import pytest
+import trio
+
+pytest.importorskip("kf2.core")  # needs the compiled library
+
+from kf2 import Fractal
+from kf2.cache import RenderCache
+
+
+async def _render(kf, size=None, zoom=None):
+    async with trio.open_nursery() as n:
+        kf.n = n
+        async with kf.render_lock(name="test setup"):
+            if size is not None:
+                kf.setImageSize(*size)
+            if zoom is not None:
+                kf.zoom(*zoom)
+        await kf.render(name="test", color=False)
+        n.cancel_scope.cancel()
+
+
+def test_buffer_copy():
+    kf = Fractal()
+    trio.run(_render, kf, (64,48))
+    view = numpy.asarray(kf.buffers.trans)
+    copy = numpy.array(kf.buffers.trans)
+    assert numpy.shares_memory(view, numpy.asarray(kf.buffers.trans))
+    assert not numpy.shares_memory(copy, view)
+
+
+def test_entry_survives_render_and_resize():
+    kf = Fractal()
+    trio.run(_render, kf, (64,48))
+    cache = RenderCache()
+    key = cache.key(kf)
+    cache.store(kf, key)
+    saved = {name: numpy.array(getattr(kf.buffers, name)) for name in ("iter_lsb", "trans")}
+
+    # render somewhere else, at another size, and back to the original size
+    trio.run(_render, kf, (32,24), (10,10,4))
+    trio.run(_render, kf, (64,48))
+    assert not numpy.array_equal(numpy.asarray(kf.buffers.iter_lsb), saved["iter_lsb"])
+
+    async def restore():
+        async with kf.render_lock(name="test restore"):
+            return cache.restore(kf, key)
+    assert trio.run(restore)
+    for name,arr in saved.items():
+        assert numpy.array_equal(numpy.asarray(getattr(kf.buffers, name)), arr)
@@ -0,0 +1,64 @@
+import numpy
+import pytest
+
+core = pytest.importorskip("kf2.core")  # needs the compiled library
+
+
+def _centers(mask, limit=16):
+    return core.glitch_centers(numpy.where(mask, -1, 1).astype(numpy.float32), limit)
+
+
+def _mask():
+    return numpy.zeros((40,30), bool)
+
+
+def test_no_glitch():
+    assert _centers(_mask()) == []
+
+
+def test_square():
+    m = _mask()
+    m[10:21, 3:14] = True
+    assert _centers(m) == [(15, 8, 121)]
+
+
+def test_inside_curved_glitch():
+    # a C shape: its centroid is outside
+    m = _mask()
+    m[5:25, 5:10] = True
+    m[5:10, 5:25] = True
+    m[20:25, 5:25] = True
+    (x,y,size), = _centers(m)
+    assert m[x,y]
+    assert size == m.sum()
+    # the center is as deep inside as possible
+    assert 7 <= y <= 7+1 and (7 <= x <= 8 or 21 <= x <= 22)
+
+
+def test_whole_frame():
+    (x,y,size), = _centers(~_mask())
+    assert size == 40*30
+    assert 19 <= x <= 20 and 14 <= y <= 15
+
+
+def test_border():
+    m = _mask()
+    m[:20] = True
+    (x,y,_), = _centers(m)
+    assert 9 <= x <= 10 and 14 <= y <= 15
+
+    m = _mask()
+    m[30:, 25:] = True
+    (x,y,_), = _centers(m)
+    assert (x,y) == (35, 27)
+
+
+def test_order_and_limit():
+    m = _mask()
+    m[1:4, 1:4] = True
+    m[10:20, 10:20] = True
+    m[30:35, 20:25] = True
+    res = _centers(m)
+    assert [size for x,y,size in res] == [100, 25, 9]
+    assert _centers(m, limit=2) == res[:2]
+    assert _centers(m, limit=0) == []
@@ -0,0 +1,71 @@
+import numpy
+import pytest
+
+pytest.importorskip("kf2.core")  # importing kf2 needs the compiled library
+
+from kf2.kfb import KFB
+
+
+def _data(w=7, h=5):
+    rng = numpy.random.default_rng(1)
+    its = rng.integers(0, 1<<20, (w,h), numpy.int32)
+    trans = rng.random((w,h), numpy.float32)
+    de = rng.random((w,h), numpy.float32)
+    return its, trans, de
+
+
+def test_roundtrip(tmp_path):
+    its, trans, _ = _data()
+    path = tmp_path/"a.kfb"
+    KFB.write(path, its, trans, iter_div=3, colors=[(1,2,3),(4,5,6)], max_iter=1000)
+    with KFB(path) as kfb:
+        assert (kfb.version, kfb.width, kfb.height) == (2, 7, 5)
+        assert (kfb.iter_div, kfb.max_iter) == (3, 1000)
+        assert kfb.colors.tolist() == [[1,2,3],[4,5,6]]
+        assert numpy.array_equal(kfb.iterations, its)
+        assert numpy.array_equal(kfb.trans, trans)
+        assert kfb.de is None
+
+
+def test_roundtrip_de(tmp_path):
+    its, trans, de = _data()
+    path = tmp_path/"a.kfb"
+    KFB.write(path, its, trans, de=de)
+    with KFB(path) as kfb:
+        assert len(kfb.colors) == 0
+        assert numpy.array_equal(kfb.iterations, its)
+        assert numpy.array_equal(kfb.trans, trans)
+        assert numpy.array_equal(kfb.de, de)
+
+
+def test_conversions(tmp_path):
+    its, trans, _ = _data()
+    its[0,0] = -1
+    path = tmp_path/"a.kfb"
+    # unsigned LSB buffers keep their bits; float64 is converted
+    KFB.write(path, its.view(numpy.uint32), trans.astype(numpy.float64))
+    with KFB(path) as kfb:
+        assert kfb.iterations[0,0] == -1
+        assert numpy.array_equal(kfb.iterations, its)
+        assert numpy.array_equal(kfb.trans, trans)
+
+
+def test_update(tmp_path):
+    its, trans, _ = _data()
+    path = tmp_path/"a.kfb"
+    KFB.write(path, its, trans)
+    with KFB(path, "r+") as kfb:
+        kfb.trans[1,2] = 42
+        kfb.trans.flush()
+    with KFB(path) as kfb:
+        assert kfb.trans[1,2] == 42
+
+
+def test_errors(tmp_path):
+    its, trans, _ = _data()
+    with pytest.raises(ValueError):
+        KFB.write(tmp_path/"a.kfb", its, trans.T)
+    path = tmp_path/"b.kfb"
+    path.write_bytes(b"PNG and some more")
+    with pytest.raises(ValueError):
+        KFB(path)
@@ -0,0 +1,66 @@
+import os
+
+import numpy
+import pytest
+import trio
+
+pytest.importorskip("kf2.core")  # needs the compiled library
+
+from kf2 import Fractal
+
+GLITCH = os.path.join(os.path.dirname(__file__), "..", "kf2", "bench", "locations", "glitch.kfr")
+
+
+async def _render(kf, stop_after_pass=False):
+    async def stopper():
+        # stop in the first glitch-correction pass
+        while kf.render_stats is None or not kf.render_stats.passes:
+            await trio.sleep(0.001)
+        kf.request_stop()
+
+    async with trio.open_nursery() as n:
+        kf.n = n
+        if stop_after_pass:
+            n.start_soon(stopper)
+        await kf.render(name="test", color=False, stop_ok=True)
+        n.cancel_scope.cancel()
+    return kf.render_stats
+
+
+def _fractal():
+    kf = Fractal()
+    kf.openFile(GLITCH)
+
+    async def setup():
+        async with kf.render_lock(name="test setup"):
+            kf.setImageSize(320,180)
+    trio.run(setup)
+    return kf
+
+
+def test_resume_same_view():
+    kf = _fractal()
+    stats = trio.run(_render, kf, True)
+    if not stats.stopped:
+        pytest.skip("the render finished before it could be stopped")
+    assert kf._partial is not None
+
+    stats = trio.run(_render, kf)
+    assert stats.resumed is not None
+    assert not stats.stopped
+    lsb = numpy.asarray(kf.buffers.iter_lsb)
+    assert not (lsb == 0x80000000).any()
+
+
+def test_no_resume_after_zoom():
+    kf = _fractal()
+    stats = trio.run(_render, kf, True)
+    if not stats.stopped:
+        pytest.skip("the render finished before it could be stopped")
+
+    async def zoom():
+        async with kf.render_lock(name="test zoom"):
+            kf.zoom(160, 90, 2)
+    trio.run(zoom)
+    stats = trio.run(_render, kf)
+    assert stats.resumed is None
@@ -0,0 +1,119 @@
+from contextlib import asynccontextmanager
+
+import pytest
+import trio
+
+pytest.importorskip("kf2.core")  # importing kf2 needs the compiled library
+
+from kf2.impl import RenderStoppedError
+from kf2.service import RenderService, LocalClient
+
+
+class StubFractal:
+    """Just enough of a Fractal for the service"""
+    is_rendering = False
+    render_stats = None
+    settings_str = "default"
+    fail = False
+
+    def __init__(self):
+        self.calls = []
+        self.size = (0,0)
+        self.started = trio.Event()
+        self.stopped = trio.Event()
+        self.block = False
+
+    @asynccontextmanager
+    async def render_lock(self, **kw):
+        yield self
+
+    def openString(self, text, noLocation=False):
+        self.calls.append(("open", text, noLocation))
+
+    def getImageSize(self):
+        return self.size
+
+    def setImageSize(self, x, y):
+        self.size = (x,y)
+
+    async def render(self, **kw):
+        self.started.set()
+        if self.block:
+            await self.stopped.wait()
+            raise RenderStoppedError()
+        if "FAIL" in self.calls[-1][1]:
+            raise RuntimeError("broken")
+
+    def request_stop(self):
+        self.stopped.set()
+
+    async def save_frame(self, *a, **kw):
+        self.calls.append(("save", kw))
+
+    def log(self, *a):
+        pass
+
+
+def _run(test):
+    async def main():
+        async with trio.open_nursery() as n:
+            service = await n.start(RenderService(1, factory=StubFractal).run)
+            await test(service, LocalClient(service))
+            n.cancel_scope.cancel()
+    # errors must not escape as exception groups
+    trio.run(main, strict_exception_groups=True)
+
+
+def test_submit():
+    async def test(service, client):
+        id = client.render("LOC", 64, 36, outputs=dict(png="/tmp/x.png"))
+        msg = await client.wait(id)
+        assert msg == dict(id=id, state="done", stats=None)
+        kf, = service._idle
+        assert kf.size == (64,36)
+        assert ("open", "LOC", False) in kf.calls
+        assert ("save", dict(save_png="/tmp/x.png")) in kf.calls
+        assert [(await client.receive())["state"] for _ in range(2)] == ["queued", "rendering"]
+    _run(test)
+
+
+def test_failed():
+    async def test(service, client):
+        id = client.render("FAIL", 64, 36)
+        assert await client.wait(id) == dict(id=id, state="failed", error="broken")
+        with pytest.raises(RuntimeError):
+            client.render("LOC", 64, 36, outputs=dict(gif="/tmp/x.gif"))
+    _run(test)
+
+
+def test_cancel_running():
+    async def test(service, client):
+        kf = service._idle[0]
+        kf.block = True
+        id = client.render("LOC", 64, 36)
+        await kf.started.wait()
+        assert client.cancel(id)
+        assert await client.wait(id) == dict(id=id, state="cancelled")
+        assert not client.cancel(id)
+    _run(test)
+
+
+def test_cancel_queued_and_status():
+    async def test(service, client):
+        kf = service._idle[0]
+        kf.block = True
+        first = client.render("LOC", 64, 36)
+        await kf.started.wait()
+        second = client.render("LOC2", 64, 36)
+
+        client.request(action="status")
+        while (msg := await client.receive())["state"] != "status":
+            pass
+        assert msg["jobs"] == {first:"rendering", second:"queued"}
+
+        assert client.cancel(second)
+        assert await client.wait(second) == dict(id=second, state="cancelled")
+        client.cancel(first)
+        await client.wait(first)
+        assert service.jobs == {}
+    _run(test)
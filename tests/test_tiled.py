@@ -0,0 +1,57 @@
+import numpy
+import pytest
+
+pytest.importorskip("kf2.core")  # importing kf2 needs the compiled library
+Image = pytest.importorskip("PIL.Image")
+
+from kf2.tiled import TiledTIFFWriter
+
+
+def _image(w, h):
+    rng = numpy.random.default_rng(2)
+    return rng.integers(0, 256, (h,w,3), numpy.uint8)
+
+
+def _write(path, img, tile, **kw):
+    h,w,_ = img.shape
+    with TiledTIFFWriter(path, w, h, tile=tile, **kw) as out:
+        # in reverse order: any order must work
+        for ty in reversed(range(out.tiles_y)):
+            for tx in reversed(range(out.tiles_x)):
+                out.write_tile(tx, ty, img[ty*tile:(ty+1)*tile, tx*tile:(tx+1)*tile])
+        return out
+
+
+@pytest.mark.parametrize("compress", [True, False])
+@pytest.mark.parametrize("bigtiff", [False, True])
+@pytest.mark.parametrize("size", [(50,40), (100,70)])
+def test_roundtrip(tmp_path, size, bigtiff, compress):
+    img = _image(*size)
+    path = tmp_path/"a.tif"
+    out = _write(path, img, 48, bigtiff=bigtiff, compress=compress)
+    assert out.bigtiff == bigtiff
+    with Image.open(path) as res:
+        assert res.size == size
+        assert res.mode == "RGB"
+        assert numpy.array_equal(numpy.asarray(res), img)
+
+
+@pytest.mark.parametrize("bigtiff", [False, True])
+def test_single_tile(tmp_path, bigtiff):
+    # offsets and counts are stored inline
+    img = _image(16, 16)
+    path = tmp_path/"a.tif"
+    out = _write(path, img, 16, bigtiff=bigtiff)
+    assert out.tiles_x == out.tiles_y == 1
+    with Image.open(path) as res:
+        assert numpy.array_equal(numpy.asarray(res), img)
+
+
+def test_errors(tmp_path):
+    with pytest.raises(ValueError):
+        TiledTIFFWriter(tmp_path/"a.tif", 100, 100, tile=20)
+    out = TiledTIFFWriter(tmp_path/"b.tif", 100, 100, tile=64)
+    out.write_tile(0, 0, _image(64,64))
+    with pytest.raises(RuntimeError):
+        out.close()
+    out.f.close()
@@ -0,0 +1,69 @@
+import json
+import threading
+
+import pytest
+
+pytest.importorskip("kf2.core")  # importing kf2 needs the compiled library
+
+from kf2.trace import Tracer
+
+
+def test_disabled():
+    t = Tracer()
+    with t.span("a", x=1):
+        t.instant("b")
+    assert t.span("a") is t.span("b")  # the shared no-op
+    assert t.to_chrome()["traceEvents"] == []
+
+
+def test_ring_buffer():
+    t = Tracer(size=3)
+    t.enable()
+    for i in range(5):
+        t.instant("i", n=i)
+    events = [e for e in t.to_chrome()["traceEvents"] if e["ph"] == "i"]
+    assert [e["args"]["n"] for e in events] == [2,3,4]
+    t.clear()
+    assert [e for e in t.to_chrome()["traceEvents"] if e["ph"] != "M"] == []
+
+
+def test_export(tmp_path):
+    t = Tracer()
+    t.enable()
+    with t.span("outer", frame=1, obj=object()):
+        with t.span("inner"):
+            pass
+        t.instant("mark")
+
+    def other():
+        with t.span("thread"):
+            pass
+    th = threading.Thread(target=other, name="worker")
+    th.start()
+    th.join()
+    t.enable(False)
+    with t.span("ignored"):
+        pass
+
+    path = tmp_path/"trace.json"
+    t.save(path)
+    with open(path) as f:
+        doc = json.load(f)
+    events = doc["traceEvents"]
+
+    names = {e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert {"worker", threading.current_thread().name} <= names
+
+    spans = {e["name"]:e for e in events if e["ph"] == "X"}
+    assert set(spans) == {"outer", "inner", "thread"}
+    outer, inner = spans["outer"], spans["inner"]
+    # the inner span begins and ends within the outer one
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"]+inner["dur"] <= outer["ts"]+outer["dur"]
+    assert outer["args"]["frame"] == 1
+    assert outer["args"]["obj"].startswith("<object")
+    assert spans["thread"]["tid"] != outer["tid"]
+
+    mark, = [e for e in events if e["ph"] == "i"]
+    assert mark["name"] == "mark" and mark["s"] == "t"
+    assert outer["ts"] <= mark["ts"] <= outer["ts"]+outer["dur"]